@@ -0,0 +1,39 @@
+"""
+One-shot import of a JSON catalog into the SQLite catalog database.
+
+    python CatalogImport.py --json catalog.json --db catalog.db
+
+Refuses to overwrite a database that already holds a catalog unless --force
+is given. Run it with the backend stopped, then start the backend with
+CATALOG_BACKEND=sqlite and CATALOG_DB_PATH pointing at the database.
+"""
+import os
+import argparse
+
+import SmartPlantBackend as backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import catalog.json into the SQLite catalog database")
+    parser.add_argument("--json", default=backend.CATALOG_PATH, help="catalog JSON file to import")
+    parser.add_argument("--db", default=backend.CATALOG_DB_PATH, help="SQLite database to write")
+    parser.add_argument("--force", action="store_true", help="replace an existing catalog in the database")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.json):
+        parser.error(f"{args.json} does not exist")
+    data = backend.read_catalog_file(args.json)
+
+    store = backend.SQLiteCatalogStore(args.db)
+    if store.version() is not None and not args.force:
+        parser.error(f"{args.db} already holds a catalog, use --force to replace it")
+    store.import_catalog(data)
+
+    catalog = store.catalog()
+    plants = sum(len(u.get("plantsList", [])) for u in catalog["userList"])
+    print(f"✅ Imported {len(catalog['userList'])} users and {plants} plants into {args.db} "
+          f"(catalogVersion {catalog.get('catalogVersion')})")
+
+
+if __name__ == "__main__":
+    main()
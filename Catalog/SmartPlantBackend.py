@@ -1,50 +1,1188 @@
 import cherrypy
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import json
+import copy
 import os
+import re
+import math
+import time
+import gzip
+import base64
+import hashlib
+from bisect import bisect_left, bisect_right
+import sqlite3
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
 import requests
 import threading
+import queue
 import asyncio
 import websockets
+import paho.mqtt.client as mqtt
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 
 CATALOG_PATH = os.path.join(os.path.dirname(__file__), "catalog.json")
+CATALOG_BACKEND = os.getenv("CATALOG_BACKEND", "json")
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", os.path.join(os.path.dirname(__file__), "catalog.db"))
+CATALOG_CHANGES_MAX = int(os.getenv("CATALOG_CHANGES_MAX", "1000"))
+CATALOG_EVENTS_TOPIC = os.getenv("CATALOG_EVENTS_TOPIC", "catalog/events")
+CATALOG_JOURNAL_COMPACT_EVERY = int(os.getenv("CATALOG_JOURNAL_COMPACT_EVERY", "200"))
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "500"))
+CATALOG_PAGE_MAX = int(os.getenv("CATALOG_PAGE_MAX", "5000"))
+TIER_MIN_POINTS = int(os.getenv("TIER_MIN_POINTS", "100"))
+SERVER_THREAD_POOL = int(os.getenv("SERVER_THREAD_POOL", "10"))     # CherryPy worker threads
+INFLUX_POOL_SIZE = int(os.getenv("INFLUX_POOL_SIZE", str(SERVER_THREAD_POOL)))  # InfluxDB clients shared by them
+PLOT_POINTS = int(os.getenv("PLOT_POINTS", "300"))                  # buckets returned by get_plot by default
+PLOT_POINTS_MAX = int(os.getenv("PLOT_POINTS_MAX", "5000"))
+RESPONSE_CACHE_TTL = {                                              # seconds a GET response is reused
+    "get_latest_tank_status": float(os.getenv("CACHE_TTL_TANK_STATUS", "5")),
+    "get_realtime_analysis": float(os.getenv("CACHE_TTL_REALTIME", "5")),
+    "get_historical_trends": float(os.getenv("CACHE_TTL_TRENDS", "60")),
+    "get_historical_alerts": float(os.getenv("CACHE_TTL_ALERTS", "30")),
+    "get_plot": float(os.getenv("CACHE_TTL_PLOT", "15"))
+}
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "2048"))
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", "500"))       # points per InfluxDB write
+ALERT_QUEUE_MAX = int(os.getenv("ALERT_QUEUE_MAX", "10000"))
+ALERT_BATCH_MAX = int(os.getenv("ALERT_BATCH_MAX", "1000"))         # alerts per POST /alerts/batch
+ALERT_COOLDOWN_SEC = int(os.getenv("ALERT_COOLDOWN_SEC", "300"))    # repeats of one alert inside this window are coalesced
+ALERT_DEDUP_KEYS = int(os.getenv("ALERT_DEDUP_KEYS", "10000"))      # (owner, plant, metric, kind) keys remembered
+# Alert kinds that are notices (e.g. irrigation) and are never coalesced
+ALERT_PASSTHROUGH_KINDS = {k.strip() for k in os.getenv("ALERT_PASSTHROUGH_KINDS", "irrigation").split(",") if k.strip()}
+ALERT_RETRY_SEC = float(os.getenv("ALERT_RETRY_SEC", "5"))           # wait before retrying a failed alert write
+WS_SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", "256"))      # frames buffered per websocket client
+WS_SLOW_POLICY = os.getenv("WS_SLOW_POLICY", "drop_oldest")         # drop_oldest | disconnect
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
 
 alert_queue = asyncio.Queue()
-active_websockets = set()
 
 
-def load_catalog():
-    if not os.path.exists(CATALOG_PATH):
+def read_catalog_file(path=None):
+    path = path or CATALOG_PATH
+    if not os.path.exists(path):
         return {"userList": []}
-    with open(CATALOG_PATH, 'r') as f:
+    with open(path, 'r') as f:
         return json.load(f)
 
+def _serialize_plants(user):
+    return {
+        plant.get("deviceConnectorSerialNumber"): json.dumps(plant, sort_keys=True)
+        for plant in (user or {}).get("plantsList", [])
+    }
+
+class CatalogChangeLog:
+    """
+    Bounded log of catalog change events keyed by catalog version.
+    Every commit bumps "catalogVersion" and records typed events:
+      - user_added / user_removed: {"event", "version", "userName"}
+      - plant_added / plant_updated / mode_changed / plant_removed: also
+        "plantSerial", "plant" (None once removed) and "op" ("upsert" or
+        "delete"); mode_changed carries the new "irrigationMode".
+    Clients ask for the events since the version they last saw instead of
+    downloading the whole catalog; listeners get each commit's events as it
+    happens.
+    """
+    def __init__(self, maxlen=CATALOG_CHANGES_MAX):
+        self._lock = threading.Lock()
+        self._changes = deque(maxlen=maxlen)
+        self._plants = {}       # userName -> {serial: serialized plant}, as last committed
+        self._version = 0
+        self._floor = 0         # changes newer than this version are all in the log
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(version, events) after every commit, even one without events."""
+        self._listeners.append(callback)
+
+    def reset(self, catalog):
+        """Start over from a catalog loaded from disk; older versions now need a full fetch."""
+        with self._lock:
+            self._version = self._floor = catalog.get("catalogVersion", 0)
+            self._changes.clear()
+            self._plants = {
+                user.get("userName"): _serialize_plants(user) for user in catalog.get("userList", [])
+            }
+
+    def _append(self, change):
+        if len(self._changes) == self._changes.maxlen:
+            self._floor = self._changes[0]["version"]
+        self._changes.append(change)
+
+    def record(self, catalog, changed=None):
+        """
+        Stamp the catalog about to be persisted with the next version and diff
+        its plant changes. `changed` maps the usernames touched to their user
+        (None if deleted); without it every user is compared. Nothing is logged
+        or published yet: pass the returned change to commit() once the catalog
+        is on disk. Callers hold their store's writer lock across both.
+        """
+        with self._lock:
+            if changed is None:
+                changed = {user.get("userName"): user for user in catalog.get("userList", [])}
+                changed.update({name: None for name in self._plants if name not in changed})
+            version = self._version + 1
+            catalog["catalogVersion"] = version
+            events, plants = [], {}
+            for name, user in changed.items():
+                user_events, plants[name] = self._diff_user(version, name, user)
+                events += user_events
+            return version, events, plants
+
+    def commit(self, change):
+        """Log and publish a change from record() after it was persisted."""
+        version, events, plants = change
+        with self._lock:
+            self._version = version
+            for name, serialized in plants.items():
+                if serialized is None:
+                    self._plants.pop(name, None)
+                else:
+                    self._plants[name] = serialized
+            for event in events:
+                self._append(event)
+            for callback in self._listeners:
+                try:
+                    callback(version, events)
+                except Exception as e:
+                    print(f"[BACKEND] Catalog change listener failed: {e}")
+            return version
+
+    def _diff_user(self, version, name, user):
+        """(events, serialized plants or None if the user is gone) for one changed user."""
+        existed = name in self._plants
+        old = self._plants.get(name, {})
+        new = _serialize_plants(user)
+        plants = {p.get("deviceConnectorSerialNumber"): p for p in (user or {}).get("plantsList", [])}
+        events = []
+        if user is not None and not existed:
+            events.append({"version": version, "event": "user_added", "userName": name})
+        for serial, serialized in new.items():
+            if serial not in old:
+                kind = "plant_added"
+            elif old[serial] != serialized:
+                before, after = json.loads(old[serial]), json.loads(serialized)
+                mode = after.pop("irrigationMode", None)
+                before.pop("irrigationMode", None)
+                kind = "mode_changed" if before == after else "plant_updated"
+            else:
+                continue
+            event = {"version": version, "event": kind, "op": "upsert",
+                     "userName": name, "plantSerial": serial, "plant": plants[serial]}
+            if kind == "mode_changed":
+                event["irrigationMode"] = mode
+            events.append(event)
+        for serial in old.keys() - new.keys():
+            events.append({"version": version, "event": "plant_removed", "op": "delete",
+                           "userName": name, "plantSerial": serial, "plant": None})
+        if user is None:
+            if existed:
+                events.append({"version": version, "event": "user_removed", "userName": name})
+            return events, None
+        return events, new
+
+    def since(self, version):
+        """Changes after `version`, or a reset marker if they are no longer in the log."""
+        with self._lock:
+            if version < self._floor or version > self._version:
+                return {"version": self._version, "reset": True, "changes": []}
+            return {
+                "version": self._version,
+                "reset": False,
+                "changes": [c for c in self._changes if c["version"] > version]
+            }
+
+catalog_changes = CatalogChangeLog()
+
+class CatalogIndex:
+    """
+    Lookups by username, (owner, plant serial) and MQTT topic, updated one user
+    at a time. Serials are only unique per owner, so plants are keyed by both.
+    """
+    def __init__(self, catalog):
+        self.users, self.plants, self.topics = {}, {}, {}
+        self._keys = {}     # userName -> (serials, topics) it contributed
+        for user in catalog.get("userList", []):
+            self.add_user(user)
+
+    def add_user(self, user):
+        name = user.get("userName")
+        self.remove_user(name)
+        serials, topics = [], []
+        for plant in user.get("plantsList", []):
+            serial = plant.get("deviceConnectorSerialNumber")
+            self.plants[(name, serial)] = (user, plant)
+            serials.append(serial)
+            for device in (plant.get("sensorList") or []) + [plant.get("waterTank"), plant.get("waterPump")]:
+                if device and device.get("mqttTopic"):
+                    self.topics[device["mqttTopic"]] = (user, plant, device)
+                    topics.append(device["mqttTopic"])
+        self.users[name] = user
+        self._keys[name] = (serials, topics)
+
+    def remove_user(self, name):
+        serials, topics = self._keys.pop(name, ((), ()))
+        for serial in serials:
+            self.plants.pop((name, serial), None)
+        for topic in topics:
+            self.topics.pop(topic, None)
+        self.users.pop(name, None)
+
+class CatalogTransaction:
+    """
+    Changes made to the catalog under the store's writer lock. Going through
+    user()/add_user()/delete_user()/set() records what was touched, so the
+    commit journals only those users and keys.
+    """
+    def __init__(self, store, catalog):
+        self.store = store
+        self.catalog = catalog
+        self.users = {}     # userName -> user dict, or None once deleted
+        self.keys = set()
+
+    def user(self, username):
+        """The user to modify, or None if there is no such user."""
+        if username in self.users:
+            return self.users[username]
+        users = self.catalog["userList"]
+        pos = next((i for i, u in enumerate(users) if u.get("userName") == username), None)
+        if pos is None:
+            return None
+        # Copy-on-write: readers keep iterating the committed user until the commit swaps this in
+        user = users[pos] = copy.deepcopy(users[pos])
+        self.users[username] = user
+        return user
+
+    def plant(self, serial, username):
+        """(user, plant) to modify if `username` owns the serial, else (None, None)."""
+        owner, _ = self.store.find_plant(serial, username)
+        if owner is None:
+            return None, None
+        user = self.user(username)
+        plant = next(p for p in user["plantsList"] if p.get("deviceConnectorSerialNumber") == serial)
+        return user, plant
+
+    def add_user(self, user):
+        self.catalog.setdefault("userList", []).append(user)
+        self.users[user["userName"]] = user
+
+    def delete_user(self, username):
+        self.catalog["userList"] = [u for u in self.catalog.get("userList", []) if u.get("userName") != username]
+        self.users[username] = None
+
+    def set(self, key, value):
+        self.catalog[key] = value
+        self.keys.add(key)
+
+class CatalogStore:
+    """
+    Process-wide catalog kept in memory, with indexes by username, plant serial
+    and MQTT topic. On disk it is a snapshot (catalog.json) plus an append-only
+    journal of committed transactions, one JSON line each:
+      - mutations take the writer lock and append O(change) bytes with fsync;
+      - the snapshot is only ever replaced through temp file + rename;
+      - a background thread folds the journal into a new snapshot once it
+        reaches CATALOG_JOURNAL_COMPACT_EVERY entries.
+    Loading replays the journal over the snapshot; replay is idempotent, so a
+    crash between writing the snapshot and removing the journal loses nothing.
+    The files are only re-read when the snapshot or journal changes on disk.
+    Returned objects are never modified in place: a transaction edits a copy of
+    the catalog and of the users it touches, and the commit swaps them in, so
+    readers can iterate what they got without the lock.
+    """
+    def __init__(self, path=None, compact_every=CATALOG_JOURNAL_COMPACT_EVERY):
+        self.path = path or CATALOG_PATH
+        self.journal_path = self.path + ".journal"
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._compact_pending = False
+        self._journal_entries = 0
+        self._stamp = None
+        self._catalog = {"userList": []}
+        self._index = CatalogIndex(self._catalog)
+        self._listing = None
+        self._listing_lock = threading.Lock()
+
+    def _file_stamp(self):
+        stamp = []
+        for path in (self.path, self.journal_path):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _replay(self, catalog, path):
+        entries = 0
+        if not os.path.exists(path):
+            return entries
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    ops = json.loads(line)["ops"]
+                except (ValueError, KeyError):
+                    break   # torn write at the tail of the journal
+                self._apply(catalog, ops)
+                entries += 1
+        return entries
+
+    @staticmethod
+    def _apply(catalog, ops):
+        users = catalog.setdefault("userList", [])
+        for op in ops:
+            if op["op"] == "set":
+                catalog[op["key"]] = op["value"]
+                continue
+            name = op["userName"]
+            pos = next((i for i, u in enumerate(users) if u.get("userName") == name), None)
+            if op["op"] == "user":
+                if pos is None:
+                    users.append(op["user"])
+                else:
+                    users[pos] = op["user"]
+            elif op["op"] == "delete_user" and pos is not None:
+                del users[pos]
+
+    def _load(self):
+        catalog = read_catalog_file(self.path)
+        self._journal_entries = self._replay(catalog, self.journal_path)
+        self._catalog = catalog
+        self._index = CatalogIndex(catalog)
+        catalog_changes.reset(catalog)
+
+    def _current(self):
+        stamp = self._file_stamp()
+        if stamp != self._stamp:
+            with self._lock:
+                stamp = self._file_stamp()
+                if stamp != self._stamp:
+                    self._load()
+                    self._stamp = stamp
+        return self._catalog, self._index
+
+    def catalog(self):
+        return self._current()[0]
+
+    def version(self):
+        return self.catalog().get("catalogVersion", 0)
+
+    def page_plants(self, cursor=None, limit=CATALOG_PAGE_SIZE, owners=None, match=None):
+        """
+        (catalogVersion, [(user, plant)], next cursor or None) for up to `limit`
+        plants passing `match`, only of `owners` (matched case-insensitively)
+        if given. The sorted listing is rebuilt once per catalog version.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        catalog = self.catalog()
+        listing = self._listing
+        if listing is None or listing.catalog is not catalog:
+            with self._listing_lock:
+                listing = self._listing
+                if listing is None or listing.catalog is not catalog:
+                    listing = self._listing = PlantListing(catalog)
+        return (catalog.get("catalogVersion", 0), *take_page(listing.rows(after, owners), limit, match))
+
+    def find_user(self, username):
+        return self._current()[1].users.get(username)
+
+    def find_plant(self, serial, username):
+        """(user, plant) for `username`'s device connector serial, or (None, None)."""
+        return self._current()[1].plants.get((username, serial), (None, None))
+
+    def find_topic(self, topic):
+        """(user, plant, device) publishing on an MQTT topic, or None."""
+        return self._current()[1].topics.get(topic)
+
+    @contextmanager
+    def transaction(self):
+        """Run a read-modify-write under the writer lock and journal it on success."""
+        with self._lock:
+            catalog, _ = self._current()
+            tx = CatalogTransaction(self, dict(catalog, userList=list(catalog.get("userList", []))))
+            try:
+                yield tx
+                if tx.users or tx.keys:
+                    self._commit(tx)
+            except BaseException:
+                self._stamp = None     # drop the copy and reload from disk
+                raise
+
+    def _commit(self, tx):
+        change = catalog_changes.record(tx.catalog, tx.users)
+        ops = [{"op": "set", "key": key, "value": tx.catalog[key]} for key in tx.keys | {"catalogVersion"}]
+        for name, user in tx.users.items():
+            if user is None:
+                ops.append({"op": "delete_user", "userName": name})
+            else:
+                ops.append({"op": "user", "userName": name, "user": user})
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps({"ops": ops}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # Only once the journal has it does the change become visible
+        for name, user in tx.users.items():
+            if user is None:
+                self._index.remove_user(name)
+            else:
+                self._index.add_user(user)
+        self._catalog = tx.catalog
+        self._journal_entries += 1
+        self._stamp = self._file_stamp()
+        catalog_changes.commit(change)
+        if self._journal_entries >= self.compact_every and not self._compact_pending:
+            self._compact_pending = True
+            threading.Thread(target=self.compact, name="catalog-compactor", daemon=True).start()
+
+    def _write_snapshot(self, serialized):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(serialized)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def compact(self):
+        """Fold the journal into a new snapshot. Holds off writers only; readers keep the cache."""
+        with self._lock:
+            self._compact_pending = False
+            if not os.path.exists(self.journal_path):
+                return
+            try:
+                self._write_snapshot(json.dumps(self._catalog, indent=4))
+                os.remove(self.journal_path)
+                self._journal_entries = 0
+            except Exception as e:
+                print(f"[BACKEND] Catalog compaction failed: {e}")
+            self._stamp = self._file_stamp()
+
+    def save(self, data):
+        """Replace the whole catalog with a fresh snapshot."""
+        with self._lock:
+            change = catalog_changes.record(data)
+            self._write_snapshot(json.dumps(data, indent=4))
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._journal_entries = 0
+            self._catalog = data
+            self._index = CatalogIndex(data)
+            self._stamp = self._file_stamp()
+            catalog_changes.commit(change)
+
+class SQLiteCatalogTransaction(CatalogTransaction):
+    """Transaction on a SQLiteCatalogStore: users are loaded on demand and written back on commit."""
+    def user(self, username):
+        # find_user() decodes a fresh copy from the database, nothing to copy
+        if username not in self.users:
+            user = self.store.find_user(username)
+            if user is None:
+                return None
+            self.users[username] = user
+        return self.users[username]
+
+    def add_user(self, user):
+        self.users[user["userName"]] = user
+
+    def delete_user(self, username):
+        self.users[username] = None
+
+class SQLiteCatalogStore:
+    """
+    Catalog kept in an SQLite database, for installs too large for one JSON file.
+    Users, plants, sensors and MQTT topics have their own indexed tables, so
+    find_user/find_plant/find_topic cost one indexed lookup instead of a full
+    load; the top-level keys (broker, influxdb, catalogVersion, ...) live in
+    `meta`. Plants are stored as their JSON document, with sensors and topics
+    denormalized next to them for lookups. A transaction takes the writer lock
+    and an IMMEDIATE SQLite transaction and rewrites only the users it touched.
+    The full catalog is assembled only for catalog() and cached per catalogVersion.
+    The backend seeds an empty database from catalog.json when it starts;
+    merely opening the store never writes a catalog.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        id          INTEGER PRIMARY KEY,
+        user_name   TEXT NOT NULL UNIQUE,
+        name_folded TEXT,
+        doc         TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS plants (
+        id         INTEGER PRIMARY KEY,
+        user_id    INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        position   INTEGER NOT NULL,
+        serial     TEXT,
+        plant_type TEXT,
+        doc        TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS plants_by_user ON plants(user_id, position);
+    CREATE INDEX IF NOT EXISTS plants_by_serial ON plants(serial);
+    CREATE TABLE IF NOT EXISTS sensors (
+        plant_id     INTEGER NOT NULL REFERENCES plants(id) ON DELETE CASCADE,
+        position     INTEGER NOT NULL,
+        measure_type TEXT,
+        mqtt_topic   TEXT
+    );
+    CREATE INDEX IF NOT EXISTS sensors_by_plant ON sensors(plant_id);
+    CREATE INDEX IF NOT EXISTS sensors_by_measure ON sensors(measure_type);
+    CREATE TABLE IF NOT EXISTS topics (
+        topic    TEXT NOT NULL,
+        plant_id INTEGER NOT NULL REFERENCES plants(id) ON DELETE CASCADE,
+        device   TEXT NOT NULL,
+        position INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS topics_by_topic ON topics(topic);
+    CREATE INDEX IF NOT EXISTS topics_by_plant ON topics(plant_id);
+    """
+
+    def __init__(self, path=None):
+        self.path = path or CATALOG_DB_PATH
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._cache = None      # (catalogVersion, catalog)
+        self._conn().executescript(self.SCHEMA)
+        self._migrate()
+        catalog_changes.reset(self.catalog())
+
+    def _migrate(self):
+        """Bring a database created before users.name_folded up to SCHEMA."""
+        conn = self._conn()
+        if "name_folded" not in {row[1] for row in conn.execute("PRAGMA table_info(users)")}:
+            with self._write() as conn:
+                conn.execute("ALTER TABLE users ADD COLUMN name_folded TEXT")
+                conn.executemany("UPDATE users SET name_folded = ? WHERE id = ?", [
+                    (name.lower(), user_id) for user_id, name in conn.execute("SELECT id, user_name FROM users")
+                ])
+        # Folded in Python, not with SQLite's ASCII-only lower(), to sort like PlantListing
+        conn.execute("CREATE INDEX IF NOT EXISTS users_by_folded_name ON users(name_folded, user_name)")
+
+    def version(self):
+        """catalogVersion stored in the database, or None while it holds no catalog."""
+        return self._version(self._conn())
+
+    def seed(self, seed_path=None):
+        """Import catalog.json (or `seed_path`) if the database holds no catalog yet."""
+        seed_path = seed_path or CATALOG_PATH
+        if self.version() is None and os.path.exists(seed_path):
+            print(f"[BACKEND] Seeding catalog database {self.path} from {seed_path}")
+            self.import_catalog(read_catalog_file(seed_path))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._cache = None
+
+    @staticmethod
+    def _version(conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'catalogVersion'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _meta(conn):
+        return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+
+    @staticmethod
+    def _user_row(conn, user_id, doc):
+        user = json.loads(doc)
+        user["plantsList"] = [
+            json.loads(plant_doc) for (plant_doc,) in
+            conn.execute("SELECT doc FROM plants WHERE user_id = ? ORDER BY position", (user_id,))
+        ]
+        return user
+
+    def _put_user(self, conn, user):
+        doc = json.dumps({k: v for k, v in user.items() if k != "plantsList"})
+        user_id = conn.execute(
+            "INSERT INTO users (user_name, name_folded, doc) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_name) DO UPDATE SET doc = excluded.doc RETURNING id",
+            (user["userName"], user["userName"].lower(), doc)
+        ).fetchone()[0]
+        conn.execute("DELETE FROM plants WHERE user_id = ?", (user_id,))
+        for position, plant in enumerate(user.get("plantsList", [])):
+            plant_id = conn.execute(
+                "INSERT INTO plants (user_id, position, serial, plant_type, doc) VALUES (?, ?, ?, ?, ?)",
+                (user_id, position, plant.get("deviceConnectorSerialNumber"), plant.get("plantType"), json.dumps(plant))
+            ).lastrowid
+            topics = []
+            for i, sensor in enumerate(plant.get("sensorList") or []):
+                conn.execute(
+                    "INSERT INTO sensors (plant_id, position, measure_type, mqtt_topic) VALUES (?, ?, ?, ?)",
+                    (plant_id, i, sensor.get("measureType"), sensor.get("mqttTopic"))
+                )
+                topics.append((sensor.get("mqttTopic"), plant_id, "sensorList", i))
+            for device in ("waterTank", "waterPump"):
+                topics.append(((plant.get(device) or {}).get("mqttTopic"), plant_id, device, None))
+            conn.executemany(
+                "INSERT INTO topics (topic, plant_id, device, position) VALUES (?, ?, ?, ?)",
+                [t for t in topics if t[0]]
+            )
+
+    def _replace_all(self, conn, data):
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM meta")
+        data = dict(data)
+        data.setdefault("catalogVersion", 0)
+        for user in data.pop("userList", []):
+            self._put_user(conn, user)
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                         [(key, json.dumps(value)) for key, value in data.items()])
+
+    def catalog(self):
+        version = self._version(self._conn())
+        cache = self._cache
+        if cache is not None and cache[0] == version:
+            return cache[1]
+        with self._lock:
+            conn = self._conn()
+            snapshot = not conn.in_transaction
+            if snapshot:
+                conn.execute("BEGIN")   # one consistent read across the tables
+            try:
+                catalog = self._meta(conn)
+                catalog["userList"] = [
+                    self._user_row(conn, user_id, doc)
+                    for user_id, doc in conn.execute("SELECT id, doc FROM users ORDER BY id").fetchall()
+                ]
+            finally:
+                if snapshot:
+                    conn.execute("COMMIT")
+            self._cache = (catalog.get("catalogVersion"), catalog)
+        return catalog
+
+    def page_plants(self, cursor=None, limit=CATALOG_PAGE_SIZE, owners=None, match=None):
+        """
+        Same contract as CatalogStore.page_plants, read in one snapshot without
+        assembling the catalog: users are walked in (name_folded, user_name)
+        order from the cursor, and only the users and plants the page reaches
+        are decoded.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        conn = self._conn()
+        snapshot = not conn.in_transaction
+        if snapshot:
+            conn.execute("BEGIN")
+        try:
+            return (self._version(conn) or 0, *take_page(self._plant_rows(conn, after, owners), limit, match))
+        finally:
+            if snapshot:
+                conn.execute("COMMIT")
+
+    @staticmethod
+    def _plant_rows(conn, after=None, owners=None):
+        """(key, user, plant) in PlantListing order after the key `after`; users carry no plantsList."""
+        where, params = [], []
+        if after:
+            where.append("(name_folded, user_name) >= (?, ?)")
+            params += after[:2]
+        if owners is not None:
+            folded = sorted({o.lower() for o in owners})
+            where.append(f"name_folded IN ({', '.join('?' * len(folded))})")
+            params += folded
+        users = conn.execute(
+            "SELECT id, user_name, name_folded, doc FROM users"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + " ORDER BY name_folded, user_name", params
+        )
+        for user_id, name, folded, doc in users:
+            user = json.loads(doc)
+            plants = sorted(
+                (str(serial or ""), plant_doc) for serial, plant_doc in
+                conn.execute("SELECT serial, doc FROM plants WHERE user_id = ?", (user_id,))
+            )
+            for serial, plant_doc in plants:
+                key = (folded, name, serial)
+                if after and key <= after:
+                    continue
+                yield key, user, json.loads(plant_doc)
+
+    def find_user(self, username):
+        conn = self._conn()
+        row = conn.execute("SELECT id, doc FROM users WHERE user_name = ?", (username,)).fetchone()
+        return self._user_row(conn, *row) if row else None
+
+    def _plant_at(self, conn, user_id, position):
+        user = self._user_row(conn, *conn.execute("SELECT id, doc FROM users WHERE id = ?", (user_id,)).fetchone())
+        return user, user["plantsList"][position]
+
+    def find_plant(self, serial, username):
+        """(user, plant) for `username`'s device connector serial, or (None, None)."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT p.user_id, p.position FROM plants p JOIN users u ON u.id = p.user_id "
+            "WHERE p.serial = ? AND u.user_name = ? ORDER BY p.id LIMIT 1", (serial, username)
+        ).fetchone()
+        return self._plant_at(conn, *row) if row else (None, None)
+
+    def find_topic(self, topic):
+        """(user, plant, device) publishing on an MQTT topic, or None."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT p.user_id, p.position, t.device, t.position FROM topics t "
+            "JOIN plants p ON p.id = t.plant_id WHERE t.topic = ? LIMIT 1", (topic,)
+        ).fetchone()
+        if not row:
+            return None
+        user, plant = self._plant_at(conn, row[0], row[1])
+        device = plant[row[2]] if row[3] is None else plant[row[2]][row[3]]
+        return user, plant, device
+
+    @contextmanager
+    def transaction(self):
+        """Run a read-modify-write under the writer lock and commit the touched users."""
+        with self._lock:
+            change = None
+            with self._write() as conn:
+                tx = SQLiteCatalogTransaction(self, self._meta(conn))
+                yield tx
+                if tx.users or tx.keys:
+                    change = catalog_changes.record(tx.catalog, tx.users)
+                    for key in tx.keys | {"catalogVersion"}:
+                        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                     (key, json.dumps(tx.catalog[key])))
+                    for name, user in tx.users.items():
+                        if user is None:
+                            conn.execute("DELETE FROM users WHERE user_name = ?", (name,))
+                        else:
+                            self._put_user(conn, user)
+            # Published only after COMMIT, still under the lock so versions go out in order
+            if change:
+                catalog_changes.commit(change)
+
+    def save(self, data):
+        """Replace the whole catalog."""
+        with self._lock:
+            with self._write() as conn:
+                change = catalog_changes.record(data)
+                self._replace_all(conn, data)
+            catalog_changes.commit(change)
+
+    def import_catalog(self, data):
+        """Replace the database contents with a JSON catalog, keeping its catalogVersion."""
+        with self._write() as conn:
+            self._replace_all(conn, data)
+        catalog_changes.reset(self.catalog())
+
+def open_catalog_store(backend=None):
+    """The catalog store selected by CATALOG_BACKEND: "json" (default) or "sqlite"."""
+    backend = backend or CATALOG_BACKEND
+    if backend == "sqlite":
+        return SQLiteCatalogStore()
+    if backend != "json":
+        raise ValueError(f"Unknown CATALOG_BACKEND: {backend}")
+    return CatalogStore()
+
+catalog_store = open_catalog_store()
+
+def load_catalog():
+    return catalog_store.catalog()
+
 def save_catalog(data):
-    with open(CATALOG_PATH, 'w') as f:
-        json.dump(data, f, indent=4)
+    catalog_store.save(data)
+
+class CatalogResponseCache:
+    """
+    The /getCatalog body serialized once per catalog version, plain and
+    gzip-compressed, with its ETag: the catalogVersion plus a digest of the
+    body, so a catalog reloaded from disk with the same version but
+    different content still gets a new tag.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = None      # (catalog, version, etag, body, gzipped body)
+
+    def get(self):
+        """(etag, body, gzipped body) for the current catalog."""
+        catalog = load_catalog()
+        version = catalog.get("catalogVersion", 0)
+        entry = self._entry
+        if entry is None or entry[0] is not catalog or entry[1] != version:
+            with self._lock:
+                entry = self._entry
+                if entry is None or entry[0] is not catalog or entry[1] != version:
+                    body = json.dumps(catalog).encode()
+                    etag = f'"{version}-{hashlib.sha1(body).hexdigest()[:12]}"'
+                    entry = (catalog, version, etag, body, gzip.compress(body, 6))
+                    self._entry = entry
+        return entry[2:]
+
+catalog_responses = CatalogResponseCache()
+
+class ResponseCache:
+    """
+    GET responses of the read-heavy endpoints, keyed by endpoint and query
+    parameters and kept for the endpoint's TTL. Concurrent misses on one key
+    are coalesced: the first request loads, the others wait for its result.
+    Only 200 responses are stored, at most `max_entries` of them (LRU). Write
+    paths call invalidate() for what they changed; a load that overlapped an
+    invalidation is returned but not stored.
+    """
+    def __init__(self, ttls=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires, status, body)
+        self._loading = {}              # key -> {"done": Event, "result": (status, body) or None}
+        self._generation = 0
+        self.hits = self.misses = self.coalesced = 0
+
+    @staticmethod
+    def key(endpoint, params):
+        return (endpoint,) + tuple(sorted((k, str(v)) for k, v in params.items()))
+
+    def get(self, endpoint, params, load):
+        """(status, body) for the request; load() returns the same on a miss."""
+        key = self.key(endpoint, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1:]
+            flight = self._loading.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._loading[key] = {"done": threading.Event(), "result": None}
+                generation = self._generation
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight["done"].wait()
+            return flight["result"] or load()
+        try:
+            flight["result"] = status, body = load()
+            with self._lock:
+                if status == 200 and generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttls[endpoint], status, body)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return status, body
+        finally:
+            with self._lock:
+                del self._loading[key]
+            flight["done"].set()
+
+    def invalidate(self, owner=None, plant=None, endpoints=None):
+        """Drop cached responses for an owner and/or plant, optionally only of some endpoints."""
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                params = dict(key[1:])
+                if endpoints and key[0] not in endpoints:
+                    continue
+                if owner and params.get("username") != owner:
+                    continue
+                if plant and params.get("plant") != plant:
+                    continue
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hitRate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0
+            }
+
+response_cache = ResponseCache()
+
+def etag_matches(etag, if_none_match):
+    """Whether an If-None-Match header value covers `etag` (weak comparison)."""
+    if not if_none_match:
+        return False
+    def opaque(tag):
+        return tag[2:] if tag.startswith("W/") else tag
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or opaque(etag) in [opaque(t) for t in tags]
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_cursor(cursor):
+    """(folded owner, owner, serial) a page cursor resumes after; ValueError if it is malformed."""
+    try:
+        folded, owner, serial = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(folded), str(owner), str(serial)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def take_page(rows, limit, match=None):
+    """
+    Up to `limit` (user, plant) of `rows`, an iterator of (key, user, plant) in
+    key order, that pass `match`, plus the cursor of the next page or None.
+    """
+    items, last = [], None
+    for key, user, plant in rows:
+        if len(items) >= limit:
+            return items, encode_cursor(last)
+        if match is None or match(plant):
+            items.append((user, plant))
+        last = key
+    return items, None
+
+class PlantListing:
+    """
+    Plants of one in-memory catalog sorted by (lowercased owner, owner, serial).
+    rows() resumes after a cursor key with a binary search, and each owner of a
+    case-insensitive owner filter is a contiguous range, so neither rescans
+    from the start.
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        rows = []
+        for user in catalog.get("userList", []):
+            name = user.get("userName") or ""
+            for plant in user.get("plantsList", []):
+                serial = str(plant.get("deviceConnectorSerialNumber") or "")
+                rows.append(((name.lower(), name, serial), (user, plant)))
+        rows.sort(key=lambda row: row[0])
+        self.keys = [key for key, _ in rows]
+        self.plants = [row for _, row in rows]
+
+    def rows(self, after=None, owners=None):
+        """(key, user, plant) after the key `after`, only of `owners` if given."""
+        start = bisect_right(self.keys, after) if after else 0
+        if owners is None:
+            spans = [(0, len(self.keys))]
+        else:
+            # Every key of a lowercased owner sorts between (owner,) and (owner + "\0",)
+            spans = sorted({(bisect_left(self.keys, (o,)), bisect_left(self.keys, (o + "\0",)))
+                            for o in {o.lower() for o in owners}})
+        for lo, hi in spans:
+            for i in range(max(lo, start), hi):
+                yield (self.keys[i], *self.plants[i])
+
+def project_plant(user, plant, fields=None):
+    """A plant with its owner, keeping only `fields` (plus the serial) when given."""
+    item = {"owner": user.get("userName"), "deviceConnectorSerialNumber": plant.get("deviceConnectorSerialNumber")}
+    item.update((k, v) for k, v in plant.items() if fields is None or k in fields)
+    return item
+
+def plant_topic_entries(owner, plant):
+    """
+    One entry per MQTT topic of a plant with the series it feeds, as the
+    InfluxDB adaptor maps them. "format" is only present when the sensor or
+    plant sets a payloadFormat.
+    """
+    serial = plant.get("deviceConnectorSerialNumber")
+    plant_format = plant.get("payloadFormat")
+    devices = [(s, (s.get("measureType") or "").strip().lower()) for s in plant.get("sensorList") or []]
+    devices.append((plant.get("waterTank") or {}, "watertank"))
+    entries = []
+    for device, measurement in devices:
+        if device.get("mqttTopic") and measurement:
+            entry = {"topic": device["mqttTopic"], "owner": owner, "plant": serial, "measurement": measurement}
+            fmt = device.get("payloadFormat", plant_format)
+            if fmt:
+                entry["format"] = fmt
+            entries.append(entry)
+    return entries
+
+def query_etag(params):
+    """
+    Weak ETag of a catalog query: the catalogVersion plus a digest of the
+    query parameters, normalized so that list order and repeated vs
+    comma-separated values do not matter. Never touches the catalog itself.
+    """
+    normalized = sorted((key, sorted(split_param(value))) for key, value in params.items())
+    digest = hashlib.sha1(json.dumps(normalized).encode()).hexdigest()[:8]
+    return f'W/"{catalog_store.version() or 0}-{digest}"'
+
+def split_param(value):
+    """Values of a query parameter given as a comma-separated list and/or repeated."""
+    values = value if isinstance(value, list) else [value]
+    return [v.strip() for item in values if item for v in item.split(",") if v.strip()]
+
+class CatalogEventPublisher:
+    """
+    Pushes every catalog commit to CATALOG_EVENTS_TOPIC as one retained QoS 1
+    message {"version": n, "events": [...]}. Versions are consecutive, so a
+    subscriber that sees a gap, or starts with an older version than the
+    retained message, replays /getCatalogChanges?since=<last version it applied>.
+    """
+    def __init__(self, topic=CATALOG_EVENTS_TOPIC):
+        self.topic = topic
+        self.client = mqtt.Client(client_id="SmartPlantBackend-catalog")
+
+    def start(self, broker):
+        self.client.connect_async(broker.get("IP", "localhost"), broker.get("port", 1883))
+        self.client.loop_start()
+        catalog_changes.add_listener(self.publish)
+        print(f"📣 Publishing catalog changes on '{self.topic}'")
+
+    def publish(self, version, events):
+        # Called under the change log lock, so messages go out in version order
+        self.client.publish(self.topic, json.dumps({"version": version, "events": events}), qos=1, retain=True)
+
+def notify_adaptor(catalog):
+    """Ask the InfluxDB adaptor to pull the latest catalog changes."""
+    try:
+        adaptor_data = catalog["influxdbAdaptor"]
+        request_url = adaptor_data["url"] + adaptor_data["updateEndpoint"]
+        requests.put(request_url, timeout=5)
+    except Exception as e:
+        print(f"[BACKEND] Failed to notify InfluxDB adaptor: {e}")
 
 def find_user(username):
-    catalog = load_catalog()
-    return next((user for user in catalog.get("userList", []) if user.get("userName") == username), None)
+    return catalog_store.find_user(username)
 
 def add_plant(new_plant, username):
-    catalog = load_catalog()
-    for user in catalog["userList"]:
-        if user["userName"] == username:
-            if len(user["plantsList"]) < 3:
-                user["plantsList"].append(new_plant)
-            break
-    save_catalog(catalog)
+    with catalog_store.transaction() as tx:
+        user = tx.user(username)
+        if user and len(user["plantsList"]) < 3:
+            user["plantsList"].append(new_plant)
 
 def remove_plant(plantserial, username):
-    catalog = load_catalog()
-    for user in catalog["userList"]:
-        if user["userName"] == username:
-            user["plantsList"] = [p for p in user["plantsList"] if p["deviceConnectorSerialNumber"] != plantserial]
-            save_catalog(catalog)
-            return {"message": "Plant removed successfully"}
-    return {"error": "User not found"}
+    with catalog_store.transaction() as tx:
+        user = tx.user(username)
+        if not user:
+            return {"error": "User not found"}
+        user["plantsList"] = [p for p in user["plantsList"] if p["deviceConnectorSerialNumber"] != plantserial]
+    return {"message": "Plant removed successfully"}
+
+# HistoricalAnalysis.py carries a copy of parse_duration/pick_tier (separate image)
+def parse_duration(text):
+    """InfluxQL duration ('10m', '48h', '30d', '260w' or 'INF') in seconds."""
+    text = str(text).strip()
+    if text.upper() == "INF":
+        return float("inf")
+    if len(text) < 2 or text[-1] not in DURATION_UNITS or not text[:-1].isdigit():
+        raise ValueError(f"Invalid duration: {text}")
+    return int(text[:-1]) * DURATION_UNITS[text[-1]]
+
+def retention_tiers():
+    return load_catalog().get("influxdb", {}).get("retentionTiers") or [{"name": "autogen", "duration": "INF"}]
+
+def pick_tier(window, tiers=None, min_points=TIER_MIN_POINTS):
+    """
+    Retention policy to read a time window from: the coarsest tier that keeps
+    the whole window and still gives min_points per series, else the finest
+    tier that keeps it. Tiers come from the catalog, finest first.
+    """
+    if tiers is None:
+        tiers = retention_tiers()
+    seconds = window if isinstance(window, (int, float)) else parse_duration(window)
+    covering = [t for t in tiers if parse_duration(t["duration"]) >= seconds]
+    if not covering:
+        covering = [max(tiers, key=lambda t: parse_duration(t["duration"]))]
+    for tier in reversed(covering):
+        interval = tier.get("interval")
+        if interval is None or seconds / parse_duration(interval) >= min_points:
+            return tier["name"]
+    return covering[0]["name"]
+
+def parse_timestamp(text):
+    """RFC3339 timestamp or epoch seconds as an aware UTC datetime."""
+    text = str(text).strip()
+    try:
+        seconds = float(text)
+    except ValueError:
+        seconds = None
+    if seconds is not None:
+        try:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError(f"Timestamp out of range: {text}")
+    try:
+        ts = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {text}")
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+def series_query(measure, owner, plant, window, start=None, end=None, points=None, resolution=None, tiers=None):
+    """
+    InfluxQL for one sensor series over the last `window`, or between `start`
+    and `end` (RFC3339 or epoch seconds; end defaults to now, and a lone end
+    reads the `window` that ends there). With `points`
+    or `resolution` the series is aggregated with GROUP BY time() into
+    mean/min/max buckets, read from the coarsest retention tier that is still
+    finer than a bucket, so the response size does not grow with the window.
+    Returns (query, bucket seconds or None); raises ValueError on bad input.
+    """
+    tiers = tiers or retention_tiers()
+    now = datetime.now(timezone.utc)
+    if start or end:
+        end = parse_timestamp(end) if end else now
+        if start:
+            start = parse_timestamp(start)
+        else:
+            span = parse_duration(window)
+            if math.isinf(span):
+                raise ValueError("window must be a finite duration")
+            try:
+                start = end - timedelta(seconds=span)
+            except OverflowError:
+                raise ValueError("window reaches before the earliest supported time")
+        if start >= end:
+            raise ValueError("start must be before end")
+        seconds = (end - start).total_seconds()
+        reach = (now - start).total_seconds()
+        rfc3339 = "%Y-%m-%dT%H:%M:%S.%fZ"
+        time_clause = f"time >= '{start.strftime(rfc3339)}' AND time <= '{end.strftime(rfc3339)}'"
+    else:
+        seconds = reach = parse_duration(window)
+        if math.isinf(seconds):
+            raise ValueError("window must be a finite duration")
+        time_clause = f"time > now() - {window}"
+    where = f"""{time_clause} AND "owner" = '{owner}' AND "plant" = '{plant}'"""
+
+    if not points and not resolution:
+        tier = pick_tier(reach, tiers)
+        return f'SELECT "value" FROM "{tier}"."{measure}" WHERE {where}', None
+
+    if resolution:
+        bucket = parse_duration(resolution)
+        if math.isinf(bucket):
+            raise ValueError("resolution must be a finite duration")
+        bucket = int(bucket)
+    else:
+        if points < 1:
+            raise ValueError("points must be positive")
+        bucket = math.ceil(seconds / min(points, PLOT_POINTS_MAX))
+    bucket = max(bucket, 1, math.ceil(seconds / PLOT_POINTS_MAX))
+    # Coarsest tier whose interval is at most one bucket
+    tier = pick_tier(reach, tiers, min_points=reach / bucket)
+    rolled_up = any(t["name"] == tier and t.get("interval") for t in tiers)
+    low, high = ("min", "max") if rolled_up else ("value", "value")
+    query = (
+        f'SELECT mean("value") AS "value", min("{low}") AS "min", max("{high}") AS "max" '
+        f'FROM "{tier}"."{measure}" WHERE {where} GROUP BY time({bucket}s) fill(none)'
+    )
+    return query, bucket
+
+def series_params(kwargs, default_points=None):
+    """points/resolution/start/end query parameters for series_query()."""
+    points = kwargs.get("points", default_points)
+    return {
+        "start": kwargs.get("start"),
+        "end": kwargs.get("end"),
+        "points": int(points) if points not in (None, "") else None,
+        "resolution": kwargs.get("resolution")
+    }
 
 def CORS():
     cherrypy.response.headers["Access-Control-Allow-Origin"] = "*"
@@ -53,20 +1191,161 @@ def CORS():
 
 cherrypy.tools.cors = cherrypy.Tool('before_handler', CORS)
 
+def subscription_keys(value):
+    values = value if isinstance(value, list) else [value]
+    return {str(v) for v in values if v not in (None, "")}
+
+class WebsocketClient:
+    """
+    One websocket connection: what it subscribed to and a bounded queue of
+    frames drained by its own writer task, so a stalled browser only ever
+    delays itself. When the queue is full the oldest frame is dropped, or
+    with WS_SLOW_POLICY=disconnect the client is closed and can reconnect.
+    A failed send closes the client too, so its queue stops filling up.
+    """
+    _closing = set()    # close() tasks, kept referenced until done so they are not garbage-collected
+
+    def __init__(self, websocket, maxsize=WS_SEND_QUEUE_MAX, policy=WS_SLOW_POLICY):
+        self.websocket = websocket
+        self.policy = policy
+        self.usernames = set()
+        self.plants = set()
+        self.everything = False
+        self.dropped = 0
+        self.closed = False
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._writer = asyncio.get_running_loop().create_task(self._write())
+
+    def offer(self, frame):
+        if self.closed:
+            return
+        if self._queue.full():
+            if self.policy == "disconnect":
+                self.close(1013, "Client too slow")
+                return
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(frame)
+
+    def close(self, code=1000, reason=""):
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        task = asyncio.get_running_loop().create_task(self.websocket.close(code, reason))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _write(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                await self.websocket.send(frame, text=True)
+        except websockets.ConnectionClosed:
+            self.close()
+        except Exception as e:
+            print(f"[BACKEND] Websocket send failed, closing client: {e}")
+            self.close(1011, "Send failed")
+
+class WebsocketRouter:
+    """
+    Websocket clients indexed by the usernames and plants they subscribed to.
+    A message is encoded once and queued only for clients interested in its
+    owner or plant. Clients subscribe by sending
+        {"type": "identify", "username": "..."}                    (frontend)
+        {"type": "subscribe", "usernames": [...], "plants": [...]}
+        {"type": "subscribe", "all": true}                         (services)
+    and "unsubscribe" with the same fields. Clients that never subscribe
+    receive nothing. Only used from the websocket event loop.
+    """
+    def __init__(self):
+        self.clients = set()
+        self._by_username = {}
+        self._by_plant = {}
+        self._everything = set()
+
+    def add(self, client):
+        self.clients.add(client)
+
+    def remove(self, client):
+        self.clients.discard(client)
+        self._everything.discard(client)
+        self._unsubscribe(client, client.usernames, client.plants)
+
+    def handle(self, client, raw):
+        try:
+            request = json.loads(raw)
+        except ValueError:
+            return
+        if not isinstance(request, dict):
+            return
+        kind = request.get("type")
+        usernames = subscription_keys(request.get("usernames"))
+        plants = subscription_keys(request.get("plants"))
+        if kind == "identify" and request.get("username"):
+            self._subscribe(client, {request["username"]}, set())
+        elif kind == "subscribe":
+            if request.get("all"):
+                client.everything = True
+                self._everything.add(client)
+            self._subscribe(client, usernames, plants)
+        elif kind == "unsubscribe":
+            if request.get("all"):
+                client.everything = False
+                self._everything.discard(client)
+            self._unsubscribe(client, usernames, plants)
+
+    def _subscribe(self, client, usernames, plants):
+        for index, keys, own in ((self._by_username, usernames, client.usernames),
+                                 (self._by_plant, plants, client.plants)):
+            for key in keys:
+                index.setdefault(key, set()).add(client)
+            own |= keys
+
+    def _unsubscribe(self, client, usernames, plants):
+        for index, keys, own in ((self._by_username, usernames, client.usernames),
+                                 (self._by_plant, plants, client.plants)):
+            for key in set(keys):
+                subscribers = index.get(key)
+                if subscribers:
+                    subscribers.discard(client)
+                    if not subscribers:
+                        del index[key]
+            own -= keys
+
+    def recipients(self, message):
+        owner = message.get("username") or message.get("owner")
+        plant = message.get("plant")
+        return self._everything.union(
+            self._by_username.get(owner, ()), self._by_plant.get(plant, ())
+        )
+
+    def publish(self, message):
+        recipients = self.recipients(message)
+        if recipients:
+            frame = json.dumps(message).encode()
+            for client in recipients:
+                client.offer(frame)
+
+websocket_router = WebsocketRouter()
+
 async def broadcast_alert_loop():
     global alert_queue
     while True:
-        alert_message = await alert_queue.get()
-        if active_websockets:
-            await asyncio.gather(*(ws.send(alert_message) for ws in active_websockets))
+        websocket_router.publish(await alert_queue.get())
+        # get() does not yield while messages are waiting; let the writers drain a burst
+        await asyncio.sleep(0)
 
 async def websocket_handler(websocket):
-    active_websockets.add(websocket)
+    client = WebsocketClient(websocket)
+    websocket_router.add(client)
     try:
-        async for _ in websocket:
-            pass
+        async for raw in websocket:
+            websocket_router.handle(client, raw)
     finally:
-        active_websockets.remove(websocket)
+        websocket_router.remove(client)
+        client.close()
 
 async def websocket_main():
     global alert_queue
@@ -91,28 +1370,403 @@ async def start_websocket_server():
 def websocket_thread_runner():
     asyncio.run(start_websocket_server())
 
+async def enqueue_broadcasts(messages):
+    for message in messages:
+        await alert_queue.put(message)
+
+ALERT_METRIC_RE = re.compile(r"^\s*\[([^\]]+)\]")
+ALERT_NUMBER_RE = re.compile(r"[-+]?\d+(?:\.\d+)?%?")
+
+def parse_alert(data):
+    """
+    Alert from a request body; ValueError if alert, username or plant is
+    missing or the timestamp is not one InfluxDB can store. The timestamp
+    (RFC3339 or epoch seconds, default now) is normalized to RFC3339 UTC.
+    Producers may tag the alert with `metric` and `kind`; otherwise the metric
+    is taken from a leading "[metric]" and the kind is the text with its
+    numbers blanked, so "predicted too LOW (12.3)" and "(12.1)" are one kind.
+    """
+    if not isinstance(data, dict) or not all(data.get(k) for k in ("alert", "username", "plant")):
+        raise ValueError("Missing fields")
+    timestamp = data.get("timestamp")
+    if timestamp:
+        ts = parse_timestamp(timestamp)
+        # InfluxDB stores nanoseconds since the epoch in an int64
+        if not 1678 <= ts.year <= 2261:
+            raise ValueError(f"Timestamp out of range: {timestamp}")
+        timestamp = ts.isoformat()
+    text = str(data["alert"])
+    metric = data.get("metric")
+    if not metric:
+        match = ALERT_METRIC_RE.match(text)
+        metric = match.group(1) if match else ""
+    return {
+        "alert": text,
+        "timestamp": timestamp or datetime.utcnow().isoformat(),
+        "owner": data["username"],
+        "plant": data["plant"],
+        "metric": metric,
+        "kind": data.get("kind") or ALERT_NUMBER_RE.sub("#", text).strip()
+    }
+
+def is_transient(error):
+    """True for write errors worth retrying: InfluxDB unreachable, timing out, 5xx or 429."""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          InfluxDBServerError)):
+        return True
+    return isinstance(error, InfluxDBClientError) and error.code == 429
+
+def format_window(seconds):
+    if seconds >= 3600 and seconds % 3600 == 0:
+        return f"{seconds // 3600} h"
+    if seconds >= 60 and seconds % 60 == 0:
+        return f"{seconds // 60} min"
+    return f"{seconds} s"
+
+class AlertSuppressor:
+    """
+    Collapses repeats of one (owner, plant, metric, kind) alert. The first
+    alert for a key goes out and opens a cooldown window; repeats inside the
+    window are only counted. When the window closes with repeats, one summary
+    goes out ("... (x12 in last 5 min)", count=12) and a new window opens, so
+    a steady storm costs one alert per window. Keys are kept in an LRU of at
+    most `max_keys`, ordered by window start; an evicted key flushes its
+    summary first. Alerts whose kind is in `passthrough` are notices of
+    something that happened, such as an irrigation, and always go out at once.
+    Used only from the AlertPipeline thread.
+    """
+    def __init__(self, cooldown=ALERT_COOLDOWN_SEC, max_keys=ALERT_DEDUP_KEYS, passthrough=ALERT_PASSTHROUGH_KINDS):
+        self.cooldown = cooldown
+        self.max_keys = max_keys
+        self.passthrough = passthrough
+        self._windows = OrderedDict()   # key -> [window start, repeats, last repeated alert]
+
+    @staticmethod
+    def key(alert):
+        return (alert["owner"], alert["plant"], alert.get("metric", ""), alert.get("kind", alert["alert"]))
+
+    def filter(self, batch, now=None):
+        """Alerts of `batch` that should go out, plus summaries of windows that closed."""
+        now = time.monotonic() if now is None else now
+        out = self.expire(now)
+        if self.cooldown <= 0:
+            return out + [dict(alert, count=1) for alert in batch]
+        for alert in batch:
+            if alert.get("kind") in self.passthrough:
+                out.append(dict(alert, count=1))
+                continue
+            key = self.key(alert)
+            window = self._windows.get(key)
+            if window:
+                window[1] += 1
+                window[2] = alert
+                continue
+            self._windows[key] = [now, 0, None]
+            out.append(dict(alert, count=1))
+            if len(self._windows) > self.max_keys:
+                out.extend(self._close(self._windows.popitem(last=False)[1]))
+        return out
+
+    def expire(self, now=None):
+        """Summaries for windows older than the cooldown; quiet keys are forgotten."""
+        now = time.monotonic() if now is None else now
+        out = []
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            if now - window[0] < self.cooldown:
+                break
+            del self._windows[key]
+            if window[1]:
+                out.extend(self._close(window))
+                self._windows[key] = [now, 0, None]
+        return out
+
+    def flush(self):
+        """Summaries of every open window, e.g. on shutdown."""
+        windows, self._windows = self._windows, OrderedDict()
+        return [alert for window in windows.values() for alert in self._close(window)]
+
+    def _close(self, window):
+        _, repeats, last = window
+        if not repeats:
+            return []
+        return [dict(
+            last,
+            alert=f"{last['alert']} (x{repeats} in last {format_window(self.cooldown)})",
+            timestamp=datetime.utcnow().isoformat(),
+            count=repeats
+        )]
+
+class AlertPipeline:
+    """
+    Alerts accepted by POST /alerts and /alerts/batch. Request threads only
+    validate and enqueue; a background thread takes whatever has queued up,
+    writes it to InfluxDB with one write_points call and hands it to the
+    websocket broadcaster. A single alert goes out as soon as it arrives,
+    while a storm is absorbed in large batches. The queue is bounded by
+    ALERT_QUEUE_MAX and submit() reports how many alerts fit. Repeats are
+    coalesced by an AlertSuppressor before anything is stored or broadcast.
+    Alerts are broadcast as they arrive; if a write fails because InfluxDB is
+    unreachable or overloaded, the alerts are kept (at most maxsize, oldest
+    dropped first) and written again every retry_sec ahead of newer ones. A
+    batch InfluxDB rejects outright (4xx) would never succeed and is dropped.
+    """
+    def __init__(self, client, database, batch_size=ALERT_BATCH_SIZE, maxsize=ALERT_QUEUE_MAX,
+                 suppressor=None, retry_sec=ALERT_RETRY_SEC):
+        self.client = client
+        self.database = database
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+        self.retry_sec = retry_sec
+        self.suppressor = suppressor or AlertSuppressor()
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._unwritten = []    # alerts whose write failed, oldest first
+        self._retry_at = 0.0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="alert-pipeline", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Process what is already queued, then stop the background thread."""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, alerts):
+        """Enqueue alerts in order without blocking; returns how many were accepted."""
+        for accepted, alert in enumerate(alerts):
+            try:
+                self._queue.put_nowait(alert)
+            except queue.Full:
+                return accepted
+        return len(alerts)
+
+    def _run(self):
+        stopping = False
+        while True:
+            try:
+                # Wake up once a second to flush summaries of closed cooldown windows
+                batch = [self._queue.get(block=not stopping, timeout=1)]
+            except queue.Empty:
+                if stopping:
+                    self._emit(self.suppressor.flush(), retry_now=True)
+                    if self._unwritten:
+                        print(f"[BACKEND] Dropping {len(self._unwritten)} alerts that could not be stored")
+                    return
+                self._emit(self.suppressor.expire())
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [alert for alert in batch if alert is not None]
+            self._emit(self.suppressor.filter(batch))
+
+    def _emit(self, batch, retry_now=False):
+        if batch:
+            self._broadcast(batch)
+        pending, self._unwritten = self._unwritten + batch, []
+        if pending and not retry_now and time.monotonic() < self._retry_at:
+            self._keep(pending)
+            return
+        for i in range(0, len(pending), self.batch_size):
+            if not self._write(pending[i:i + self.batch_size]):
+                self._keep(pending[i:])
+                self._retry_at = time.monotonic() + self.retry_sec
+                return
+
+    def _keep(self, alerts):
+        if len(alerts) > self.maxsize:
+            print(f"[BACKEND] Dropped {len(alerts) - self.maxsize} alerts that could not be stored")
+        self._unwritten = alerts[-self.maxsize:]
+
+    def _write(self, batch):
+        """Store alerts in InfluxDB; False if the write failed and is worth retrying."""
+        points = [{
+            "measurement": "user_alerts",
+            "tags": {"owner": alert["owner"], "plant": alert["plant"]},
+            "fields": {"alert_text": alert["alert"], "count": alert["count"]},
+            "time": alert["timestamp"]
+        } for alert in batch]
+        try:
+            self.client.write_points(points, database=self.database)
+        except Exception as e:
+            if is_transient(e):
+                print(f"[BACKEND] Failed to write {len(points)} alerts, retrying in {self.retry_sec}s: {e}")
+                return False
+            print(f"[BACKEND] InfluxDB rejected {len(points)} alerts, dropping them: {e}")
+            return True
+        for owner, plant in {(alert["owner"], alert["plant"]) for alert in batch}:
+            response_cache.invalidate(owner, plant, ("get_historical_alerts",))
+        return True
+
+    def _broadcast(self, batch):
+        if websocket_loop:
+            messages = [{"type": "alert", **alert} for alert in batch]
+            asyncio.run_coroutine_threadsafe(enqueue_broadcasts(messages), websocket_loop)
+
+class CatalogResource(object):
+    """
+    GET /getCatalog, served from CatalogResponseCache. Clients send back the
+    ETag in If-None-Match and get an empty 304 while the catalog is unchanged.
+    """
+    exposed = True
+
+    def GET(self, *args, **kwargs):
+        fields = split_param(kwargs.get("fields"))
+        if fields:
+            # Top-level projection, e.g. ?fields=broker,influxdb for service configuration
+            catalog = load_catalog()
+            projected = {k: catalog[k] for k in fields if k in catalog}
+            if "userList" in projected:
+                projected["userList"] = [{k: v for k, v in user.items() if k != "password"}
+                                         for user in projected["userList"]]
+            cherrypy.response.headers["Content-Type"] = "application/json"
+            return json.dumps(projected).encode()
+        etag, body, gzipped = catalog_responses.get()
+        headers = cherrypy.response.headers
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
+        headers["Vary"] = "Accept-Encoding"
+        if etag_matches(etag, cherrypy.request.headers.get("If-None-Match")):
+            cherrypy.response.status = 304
+            return b""
+        headers["Content-Type"] = "application/json"
+        if "gzip" in cherrypy.request.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            return gzipped
+        return body
+
+class InfluxPool:
+    """
+    InfluxDB clients shared by the request threads. Each call borrows an idle
+    client and gives it back, so a client is never used by two threads at
+    once and keeps its keep-alive connection warm between requests. The
+    database is passed per call instead of switch_database() on shared
+    state. Calls wait while all `size` clients are busy.
+    """
+    def __init__(self, host, port, size=INFLUX_POOL_SIZE):
+        self._idle = queue.LifoQueue()
+        for _ in range(max(size, 1)):
+            self._idle.put(InfluxDBClient(host=host, port=port, pool_size=1))
+
+    @contextmanager
+    def client(self):
+        client = self._idle.get()
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def query(self, query, database):
+        with self.client() as client:
+            return client.query(query, database=database)
+
+    def write_points(self, points, database):
+        with self.client() as client:
+            return client.write_points(points, database=database)
+
 class SmartPlantBackend(object):
     exposed = True
 
     def __init__(self):
         catalog = load_catalog()
         influx_info = catalog.get("influxdb", {})
-        self.client = InfluxDBClient(
-            host=influx_info.get("url", "http://influxdb:8086").replace("http://", "").split(":")[0],
-            port=int(influx_info.get("url", "http://influxdb:8086").split(":")[-1])
-        )
+        influx_host = influx_info.get("url", "http://influxdb:8086").replace("http://", "").split(":")[0]
+        influx_port = int(influx_info.get("url", "http://influxdb:8086").split(":")[-1])
+        self.influx = InfluxPool(influx_host, influx_port)
         self.sensor_db = influx_info.get("sensorDataBaseName", "plants_measurements")
         self.notifications_db = influx_info.get("notificationsDataBase", "user_notifications")
         self.analysis_db = influx_info.get("microServicesDataBaseName", "analysis_data")
+        self.getCatalog = CatalogResource()
+        self.alerts = AlertPipeline(self.influx, self.notifications_db)
+        self.alerts.start()
+        cherrypy.engine.subscribe("stop", self.alerts.stop)
 
 
     def OPTIONS(self, *args, **kwargs):
         cherrypy.response.status = 200
         return ""
 
+    def _query_catalog(self, view, kwargs):
+        """
+        /getPlants: plants with their owner (never user passwords), filtered by
+        owner, irrigationMode and plantType, projected to `fields`.
+        /getTopicMap: flat topic -> series entries for ingest, optionally only
+        for the given `topic`s.
+        Both page by `limit` plants and return `nextCursor` until exhausted.
+        """
+        etag = query_etag(kwargs)
+        cherrypy.response.headers["ETag"] = etag
+        if etag_matches(etag, cherrypy.request.headers.get("If-None-Match")):
+            cherrypy.response.status = 304
+            return None
+
+        if view == "getTopicMap" and kwargs.get("topic"):
+            topics = []
+            for topic in split_param(kwargs["topic"]):
+                found = catalog_store.find_topic(topic)
+                if found:
+                    owner, plant, _ = found
+                    topics += [e for e in plant_topic_entries(owner.get("userName"), plant) if e["topic"] == topic]
+            return {"catalogVersion": catalog_store.version() or 0, "topics": topics, "nextCursor": None}
+
+        try:
+            limit = min(int(kwargs.get("limit", CATALOG_PAGE_SIZE)), CATALOG_PAGE_MAX)
+        except ValueError:
+            cherrypy.response.status = 400
+            return {"error": "limit must be an integer"}
+        if limit < 1:
+            cherrypy.response.status = 400
+            return {"error": "limit must be positive"}
+
+        filters = {
+            key: {v.lower() for v in split_param(kwargs.get(key))}
+            for key in ("irrigationMode", "plantType") if kwargs.get(key)
+        }
+        def match(plant):
+            return all(str(plant.get(key, "")).lower() in values for key, values in filters.items())
+
+        try:
+            version, items, cursor = catalog_store.page_plants(
+                cursor=kwargs.get("cursor"), limit=limit, owners=split_param(kwargs.get("owner")) or None,
+                match=match if filters else None
+            )
+        except ValueError as e:
+            cherrypy.response.status = 400
+            return {"error": str(e)}
+
+        if view == "getTopicMap":
+            topics = [e for user, plant in items for e in plant_topic_entries(user.get("userName"), plant)]
+            return {"catalogVersion": version, "topics": topics, "nextCursor": cursor}
+        fields = set(split_param(kwargs.get("fields"))) or None
+        return {
+            "catalogVersion": version,
+            "plants": [project_plant(user, plant, fields) for user, plant in items],
+            "nextCursor": cursor
+        }
+
     @cherrypy.tools.json_in()
     @cherrypy.tools.json_out()
     def GET(self, *args, **kwargs):
+        if args and args[0] == "cacheStats":
+            return response_cache.stats()
+        if args and args[0] in response_cache.ttls:
+            def load():
+                body = self._read(*args, **kwargs)
+                return cherrypy.response.status or 200, body
+            status, body = response_cache.get(args[0], kwargs, load)
+            cherrypy.response.status = status
+            return body
+        return self._read(*args, **kwargs)
+
+    def _read(self, *args, **kwargs):
         if args and args[0] == "user":
             username = cherrypy.request.params.get("username")
             if not username:
@@ -132,52 +1786,63 @@ class SmartPlantBackend(object):
             username = kwargs.get("username")
             plant = kwargs.get("plant")
             measure = kwargs.get("measure")
+            window = kwargs.get("window", "10m")
             if not all([username, plant, measure]):
                 cherrypy.response.status = 400
                 return {"error": "Missing parameters"}
+            try:
+                # Raw points unless points or resolution asks for aggregation
+                query, _ = series_query(measure, username, plant, window, **series_params(kwargs))
+            except ValueError as e:
+                cherrypy.response.status = 400
+                return {"error": str(e)}
 
-            self.client.switch_database(self.sensor_db)
-
-            query = f"""
-            SELECT value FROM {measure} 
-            WHERE time > now() - 10m 
-            AND "owner" = '{username}' 
-            AND "plant" = '{plant}'
-            """
-            result = self.client.query(query)
+            result = self.influx.query(query, database=self.sensor_db)
             return list(result.get_points())
 
         if args and args[0] == "get_plot":
             username = kwargs.get("username")
             plant = kwargs.get("plant")
             graph = kwargs.get("graph")
+            window = kwargs.get("window", "1h")
             if not all([username, plant, graph]):
                 cherrypy.response.status = 400
                 return {"error": "Missing parameters"}
+            try:
+                # At most PLOT_POINTS mean/min/max buckets by default; points=0 gives raw points
+                query, bucket = series_query(graph, username, plant, window, **series_params(kwargs, PLOT_POINTS))
+            except ValueError as e:
+                cherrypy.response.status = 400
+                return {"error": str(e)}
 
-            self.client.switch_database(self.sensor_db)
-
-            query = f"""
-            SELECT value, time FROM {graph} 
-            WHERE time > now() - 1h 
-            AND "owner" = '{username}' 
-            AND "plant" = '{plant}'
-            """
-            result = self.client.query(query)
+            result = self.influx.query(query, database=self.sensor_db)
             points = list(result.get_points())
 
             if not points:
                 cherrypy.response.status = 404
                 return {"error": "No data available"}
 
-            return {
+            plot = {
                 "timestamps": [p["time"] for p in points],
                 "values": [p["value"] for p in points]
             }
+            if bucket:
+                plot["min"] = [p["min"] for p in points]
+                plot["max"] = [p["max"] for p in points]
+                plot["interval"] = bucket
+            return plot
 
 
-        if args and args[0] == "getCatalog":
-            return load_catalog()
+        if args and args[0] in ("getPlants", "getTopicMap"):
+            return self._query_catalog(args[0], kwargs)
+
+        if args and args[0] == "getCatalogChanges":
+            try:
+                since = int(kwargs.get("since", 0))
+            except ValueError:
+                cherrypy.response.status = 400
+                return {"error": "since must be an integer version"}
+            return catalog_changes.since(since)
 
         if args and args[0] == "get_latest_tank_status":
             username = kwargs.get("username")
@@ -186,14 +1851,12 @@ class SmartPlantBackend(object):
                 cherrypy.response.status = 400
                 return {"error": "Missing parameters"}
             try:
-                self.client.switch_database(self.sensor_db)
-
                 query = (
                     f'SELECT LAST("value") '
                     f'FROM "watertank" '
                     f"WHERE \"owner\" = '{username}' AND \"plant\" = '{plant}'"
                 )
-                result = self.client.query(query)
+                result = self.influx.query(query, database=self.sensor_db)
 
                 points = list(result.get_points())
                 if points:
@@ -216,13 +1879,12 @@ class SmartPlantBackend(object):
                 return {"error": "Missing parameters"}
 
             try:
-                self.client.switch_database(self.analysis_db)
                 query = f"""
                 SELECT * FROM historical_analysis
                 WHERE "owner" = '{username}' AND "plant" = '{plant}'
                 AND time > now() - 1d
                 """
-                result     = self.client.query(query)
+                result     = self.influx.query(query, database=self.analysis_db)
                 raw_points = list(result.get_points())
 
                 trends = { m: [] for m in ["temperature","humidity","moisture","ph"] }
@@ -253,13 +1915,12 @@ class SmartPlantBackend(object):
                 return {"error": "Missing parameters"}
 
             try:
-                self.client.switch_database(self.notifications_db)
                 query = f"""
                 SELECT * FROM user_alerts
                 WHERE "owner" = '{username}' AND "plant" = '{plant}'
                 AND time > now() - 2d
                 """
-                result = self.client.query(query)
+                result = self.influx.query(query, database=self.notifications_db)
                 points = list(result.get_points())
                 return points
             except Exception as e:
@@ -274,14 +1935,13 @@ class SmartPlantBackend(object):
                 return {"error": "Missing parameters"}
 
             try:
-                self.client.switch_database(self.analysis_db)
                 query = f"""
                 SELECT * FROM realtime_analysis
                 WHERE "owner" = '{username}' AND "plant" = '{plant}'
                 ORDER BY time ASC
                 LIMIT 1000
                 """
-                result = self.client.query(query)
+                result = self.influx.query(query, database=self.analysis_db)
                 points = list(result.get_points())
                 if not points:
                     return []
@@ -331,20 +1991,18 @@ class SmartPlantBackend(object):
                 cherrypy.response.status = 400
                 return {"error": "Username and password required"}
 
-            catalog = load_catalog()
-            for user in catalog.get("userList", []):
-                if user.get("userName") == username:
+            with catalog_store.transaction() as tx:
+                if find_user(username):
                     cherrypy.response.status = 409
                     return {"error": "Username already exists"}
 
-            new_user = {
-                "userName": username,
-                "password": password,
-                "plantsList": []
-            }
-            catalog["userList"].append(new_user)
-            catalog["lastUpdate"] = datetime.utcnow().strftime("%Y-%m-%d")
-            save_catalog(catalog)
+                new_user = {
+                    "userName": username,
+                    "password": password,
+                    "plantsList": []
+                }
+                tx.add_user(new_user)
+                tx.set("lastUpdate", datetime.utcnow().strftime("%Y-%m-%d"))
 
             return {"message": "User registered successfully"}
 
@@ -429,14 +2087,10 @@ class SmartPlantBackend(object):
                 return {"error": "username and plantSerial required"}
 
             if pct is None:
-                catalog    = load_catalog()
                 plant_type = None
-                for u in catalog.get("userList", []):
-                    if u["userName"] == username:
-                        for p in u.get("plantsList", []):
-                            if p["deviceConnectorSerialNumber"] == plant_serial:
-                                plant_type = p["plantType"].lower()
-                                break
+                owner, plant = catalog_store.find_plant(plant_serial, username)
+                if owner:
+                    plant_type = plant["plantType"].lower()
 
                 DEFAULT_MANUAL = {
                     "cactus":      15,
@@ -462,13 +2116,13 @@ class SmartPlantBackend(object):
 
                 if websocket_loop:
                     asyncio.run_coroutine_threadsafe(
-                        alert_queue.put(json.dumps({
+                        alert_queue.put({
                             "type":       "irrigation",
                             "username":   username,
                             "plant":      plant_serial,
                             "percentage": pct,
                             "timestamp":  datetime.datetime.utcnow().isoformat()
-                        })),
+                        }),
                         websocket_loop
                     )
 
@@ -480,52 +2134,46 @@ class SmartPlantBackend(object):
                 cherrypy.response.status = 500
                 return {"error": str(e)}
             
-        if action == "alerts":
-            from datetime import datetime 
-
-            alert_text = data.get("alert")
-            timestamp = data.get("timestamp", datetime.utcnow().isoformat())
-            username = data.get("username")
-            plant = data.get("plant")
-
-            if not alert_text or not username or not plant:
+        if action == "invalidateCache":
+            # For services that write InfluxDB directly, e.g. HistoricalAnalysis after a cycle
+            endpoints = data.get("endpoints")
+            if endpoints is not None and not isinstance(endpoints, list):
                 cherrypy.response.status = 400
-                return {"error": "Missing fields"}
+                return {"error": "endpoints must be a list"}
+            response_cache.invalidate(data.get("username"), data.get("plant"), endpoints)
+            return {"status": "ok"}
 
-            self.client.switch_database(self.notifications_db)
-            point = {
-                "measurement": "user_alerts",
-                "tags": {
-                    "owner": username,
-                    "plant": plant
-                },
-                "fields": {
-                    "alert_text": alert_text
-                },
-                "time": timestamp
-            }
-            self.client.write_points([point])
-
-            if websocket_loop:
-                import asyncio, json
-                asyncio.run_coroutine_threadsafe(
-                    alert_queue.put(
-                        json.dumps({
-                            "type": "alert",
-                            "alert": alert_text,
-                            "timestamp": timestamp,
-                            "owner": username,
-                            "plant": plant
-                        })
-                    ),
-                    websocket_loop
-                )
+        if action == "alerts":
+            if len(args) > 1 and args[1] == "batch":
+                items = data.get("alerts") if isinstance(data, dict) else data
+                if not isinstance(items, list) or not items:
+                    cherrypy.response.status = 400
+                    return {"error": "Expected a non-empty list of alerts"}
+                if len(items) > ALERT_BATCH_MAX:
+                    cherrypy.response.status = 413
+                    return {"error": f"At most {ALERT_BATCH_MAX} alerts per batch"}
+                parsed, invalid = [], []
+                for i, item in enumerate(items):
+                    try:
+                        parsed.append(parse_alert(item))
+                    except ValueError:
+                        invalid.append(i)
+                accepted = self.alerts.submit(parsed)
+                # 503 asks the producer to retry the valid alerts after the first `accepted`
+                cherrypy.response.status = 202 if accepted == len(parsed) else 503
+                return {"accepted": accepted, "invalid": invalid}
 
+            try:
+                alert = parse_alert(data)
+            except ValueError as e:
+                cherrypy.response.status = 400
+                return {"error": str(e)}
+            if not self.alerts.submit([alert]):
+                cherrypy.response.status = 503
+                return {"error": "Alert queue is full, retry later"}
+            # Stays 200 for the existing producers, although the write now happens in the background
             return {"status": "Alert received"}
 
-
-
-
         cherrypy.response.status = 404
         return {"error": "Unknown POST action"}
     
@@ -540,32 +2188,31 @@ class SmartPlantBackend(object):
             username = data.get("username")
             serialNumber = data.get("plantSerial")
             newMode = data.get("newMode")
-            catalog = load_catalog()
-            for user in catalog.get("userList", []):
-                if user["userName"] == username:
-                    for plant in user["plantsList"]:
-                        if plant["deviceConnectorSerialNumber"] == serialNumber:
-                            plant["irrigationMode"] = newMode
-                            user["lastUpdate"] = datetime.utcnow().strftime("%Y-%m-%d")
-                            catalog["lastUpdate"] = user["lastUpdate"]
-                            save_catalog(catalog)
-
-                            try:
-                                irrigation_control_url = "http://irrigation_control:8083/change_irrigation_mode"
-                                payload = {
-                                    "plantSerial": serialNumber,
-                                    "newMode": newMode
-                                }
-                                headers = {'Content-Type': 'application/json'}
-                                response = requests.put(irrigation_control_url, json=payload, headers=headers, timeout=3)
-                                if response.status_code == 200:
-                                    print(f"✅ Irrigation Control updated for {serialNumber}: {newMode}")
-                                else:
-                                    print(f"⚠️ Failed to update Irrigation Control, status {response.status_code}")
-                            except Exception as e:
-                                print(f"❌ Error contacting Irrigation Control: {e}")
-
-                            return {"message": "Mode updated"}
+            with catalog_store.transaction() as tx:
+                user, plant = tx.plant(serialNumber, username)
+                found = user is not None
+                if found:
+                    plant["irrigationMode"] = newMode
+                    user["lastUpdate"] = datetime.utcnow().strftime("%Y-%m-%d")
+                    tx.set("lastUpdate", user["lastUpdate"])
+            if found:
+
+                try:
+                    irrigation_control_url = "http://irrigation_control:8083/change_irrigation_mode"
+                    payload = {
+                        "plantSerial": serialNumber,
+                        "newMode": newMode
+                    }
+                    headers = {'Content-Type': 'application/json'}
+                    response = requests.put(irrigation_control_url, json=payload, headers=headers, timeout=3)
+                    if response.status_code == 200:
+                        print(f"✅ Irrigation Control updated for {serialNumber}: {newMode}")
+                    else:
+                        print(f"⚠️ Failed to update Irrigation Control, status {response.status_code}")
+                except Exception as e:
+                    print(f"❌ Error contacting Irrigation Control: {e}")
+
+                return {"message": "Mode updated"}
             cherrypy.response.status = 404
             return {"error": "Plant or user not found"}
 
@@ -597,23 +2244,22 @@ class SmartPlantBackend(object):
                     pass
 
             try:
-                self.client.switch_database(sensor_db)
                 for m in ["temperature", "humidity", "moisture", "ph"]:
-                    self.client.query(f"DELETE FROM {m} WHERE owner='{username}'")
+                    self.influx.query(f"DELETE FROM {m} WHERE owner='{username}'", database=sensor_db)
 
-                self.client.switch_database(analysis_db)
-                self.client.query(f"DELETE FROM realtime_analysis WHERE owner='{username}'")
-                self.client.query(f"DELETE FROM historical_analysis WHERE owner='{username}'")
+                self.influx.query(f"DELETE FROM realtime_analysis WHERE owner='{username}'", database=analysis_db)
+                self.influx.query(f"DELETE FROM historical_analysis WHERE owner='{username}'", database=analysis_db)
 
-                self.client.switch_database(notifications_db)
-                self.client.query(f"DELETE FROM user_alerts WHERE owner='{username}'")
+                self.influx.query(f"DELETE FROM user_alerts WHERE owner='{username}'", database=notifications_db)
 
             except Exception as e:
                 print(f"Error while deleting user data: {e}")
+            response_cache.invalidate(username)
 
-            catalog["userList"] = [u for u in catalog["userList"] if u["userName"] != username]
-            catalog["lastUpdate"] = datetime.utcnow().strftime("%Y-%m-%d")
-            save_catalog(catalog)
+            with catalog_store.transaction() as tx:
+                tx.delete_user(username)
+                tx.set("lastUpdate", datetime.utcnow().strftime("%Y-%m-%d"))
+            notify_adaptor(catalog)
             return {"message": "User deleted successfully"}
         
         if args and args[0] == "deletePlant":
@@ -633,29 +2279,32 @@ class SmartPlantBackend(object):
                 pass
 
             try:
-                self.client.switch_database(sensor_db)
                 for m in ["temperature", "humidity", "moisture", "ph"]:
-                    self.client.query(
-                        f"DELETE FROM {m} WHERE owner='{username}' AND plant='{plantSerial}'"
+                    self.influx.query(
+                        f"DELETE FROM {m} WHERE owner='{username}' AND plant='{plantSerial}'",
+                        database=sensor_db
                     )
 
-                self.client.switch_database(analysis_db)
-                self.client.query(
-                    f"DELETE FROM realtime_analysis WHERE owner='{username}' AND plant='{plantSerial}'"
+                self.influx.query(
+                    f"DELETE FROM realtime_analysis WHERE owner='{username}' AND plant='{plantSerial}'",
+                    database=analysis_db
                 )
-                self.client.query(
-                    f"DELETE FROM historical_analysis WHERE owner='{username}' AND plant='{plantSerial}'"
+                self.influx.query(
+                    f"DELETE FROM historical_analysis WHERE owner='{username}' AND plant='{plantSerial}'",
+                    database=analysis_db
                 )
 
-                self.client.switch_database(notifications_db)
-                self.client.query(
-                    f"DELETE FROM user_alerts WHERE owner='{username}' AND plant='{plantSerial}'"
+                self.influx.query(
+                    f"DELETE FROM user_alerts WHERE owner='{username}' AND plant='{plantSerial}'",
+                    database=notifications_db
                 )
 
             except Exception as e:
                 print(f"Error while deleting plant data: {e}")
+            response_cache.invalidate(username, plantSerial)
 
             remove_plant(plantSerial, username)
+            notify_adaptor(catalog)
             return {"message": "Plant removed successfully"}
 
         cherrypy.response.status = 404
@@ -666,8 +2315,11 @@ class SmartPlantBackend(object):
         
 
 if __name__ == "__main__":
+    if isinstance(catalog_store, SQLiteCatalogStore):
+        catalog_store.seed()
     websocket_thread = threading.Thread(target=websocket_thread_runner, daemon=True)
     websocket_thread.start()
+    CatalogEventPublisher().start(load_catalog().get("broker", {}))
 
     config = {
         '/': {
@@ -680,8 +2332,11 @@ if __name__ == "__main__":
     cherrypy.tree.mount(SmartPlantBackend(), '/', config)
     cherrypy.config.update({
         'server.socket_host': '0.0.0.0',
-        'server.socket_port': 8080
+        'server.socket_port': 8080,
+        'server.thread_pool': SERVER_THREAD_POOL
     })
+    # Turn SIGTERM (docker stop) into an engine stop so the 'stop' subscribers run
+    cherrypy.engine.signals.subscribe()
     print("🌿 SmartPlantBackend running on http://0.0.0.0:8080")
     cherrypy.engine.start()
     cherrypy.engine.block()
@@ -17,7 +17,11 @@ HIST_INTERVAL    = int(os.getenv("HIST_INTERVAL_SEC", "60"))  # seconds between
 MIN_POINTS       = int(os.getenv("HIST_MIN_POINTS", "5"))      # minimum data points per metric
 CLUSTERS         = int(os.getenv("HIST_NUM_CLUSTERS", "3"))    # KMeans clusters
 BUFFER_FACTOR    = float(os.getenv("HIST_BUFFER_FACTOR", "0.2")) # buffer ratio
+TIER_MIN_POINTS  = int(os.getenv("TIER_MIN_POINTS", "100"))   # points per series before a coarser tier is used
+ALERT_BATCH      = int(os.getenv("HIST_ALERT_BATCH", "100"))  # alerts per POST /alerts/batch
+ALERT_RETRIES    = int(os.getenv("HIST_ALERT_RETRIES", "3"))  # re-sends of alerts the backend could not queue
 METRICS          = ["temperature", "humidity", "moisture", "ph"]
+DURATION_UNITS   = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
 
 OPTIMAL_RANGES = {
     "cactus":       {"moisture": (10, 30), "temperature": (25, 35), "humidity": (30, 50), "ph": (6.5, 7.5)},
@@ -27,29 +31,92 @@ OPTIMAL_RANGES = {
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+_session = requests.Session()
+_catalog_cache = {"etag": None, "catalog": None}
+
 def load_catalog():
+    """Fetch the catalog, reusing the last one when the backend answers 304 to its ETag."""
     while True:
         try:
-            resp = requests.get(CATALOG_ENDPOINT, timeout=5)
+            etag = _catalog_cache["etag"]
+            headers = {"If-None-Match": etag} if etag else {}
+            resp = _session.get(CATALOG_ENDPOINT, headers=headers, timeout=5)
+            if resp.status_code == 304 and _catalog_cache["catalog"] is not None:
+                return _catalog_cache["catalog"]
             resp.raise_for_status()
-            return resp.json()
+            _catalog_cache["catalog"] = resp.json()
+            _catalog_cache["etag"] = resp.headers.get("ETag")
+            return _catalog_cache["catalog"]
         except Exception as e:
             logging.warning(f"Waiting for catalog: {e}")
             time.sleep(2)
 
-def send_alert(owner: str, plant: str, plant_name: str, message: str):
-    payload = {
+# parse_duration/pick_tier mirror the backend's; every service image is built
+# from its own directory, so they cannot share a module. Keep them in sync.
+def parse_duration(text):
+    """InfluxQL duration ('10m', '48h', '30d', '260w' or 'INF') in seconds."""
+    text = str(text).strip()
+    if text.upper() == "INF":
+        return float("inf")
+    if len(text) < 2 or text[-1] not in DURATION_UNITS or not text[:-1].isdigit():
+        raise ValueError(f"Invalid duration: {text}")
+    return int(text[:-1]) * DURATION_UNITS[text[-1]]
+
+def pick_tier(window, tiers, min_points=TIER_MIN_POINTS):
+    """Coarsest retention tier that keeps the window with enough points, else the finest that keeps it."""
+    seconds = parse_duration(window)
+    covering = [t for t in tiers if parse_duration(t["duration"]) >= seconds]
+    if not covering:
+        covering = [max(tiers, key=lambda t: parse_duration(t["duration"]))]
+    for tier in reversed(covering):
+        interval = tier.get("interval")
+        if interval is None or seconds / parse_duration(interval) >= min_points:
+            return tier["name"]
+    return covering[0]["name"]
+
+def alert_payload(owner: str, plant: str, plant_name: str, metric: str, kind: str, message: str):
+    # metric and kind let the backend coalesce repeats of the same alert
+    return {
         "alert":     message,
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "username":  owner,
         "plant":     plant,
-        "plantName": plant_name
+        "plantName": plant_name,
+        "metric":    metric,
+        "kind":      kind
     }
-    try:
-        requests.post(f"{BACKEND_URL}/alerts", json=payload, timeout=5)
-        logging.warning(f"Alert sent: {message}")
-    except Exception as e:
-        logging.error(f"Failed sending alert: {e}")
+
+def send_alerts(payloads):
+    """
+    Post a list of alerts to the backend in one /alerts/batch request. On a 503
+    (queue full) or a connection error, the alerts not yet accepted are sent
+    again with exponential backoff, up to ALERT_RETRIES times.
+    """
+    delay = 1
+    for attempt in range(ALERT_RETRIES + 1):
+        if not payloads:
+            return
+        if attempt:
+            time.sleep(delay)
+            delay *= 2
+        try:
+            resp = _session.post(f"{BACKEND_URL}/alerts/batch", json={"alerts": payloads}, timeout=5)
+        except Exception as e:
+            logging.error(f"Failed sending alerts: {e}")
+            continue
+        if resp.status_code not in (202, 503):
+            logging.error(f"Backend rejected {len(payloads)} alerts (HTTP {resp.status_code})")
+            return
+        body = resp.json()
+        # "accepted" counts valid alerts in order; invalid ones are never retried
+        invalid = set(body.get("invalid", []))
+        valid = [p for i, p in enumerate(payloads) if i not in invalid]
+        accepted = len(valid) if resp.status_code == 202 else body.get("accepted", 0)
+        for p in valid[:accepted]:
+            logging.warning(f"Alert sent: {p['alert']}")
+        payloads = valid[accepted:]
+    if payloads:
+        logging.error(f"Backend could not queue {len(payloads)} alerts after {ALERT_RETRIES} retries")
 
 catalog      = load_catalog()
 influx_cfg   = catalog.get("influxdb", {})
@@ -58,18 +125,29 @@ DB_ANALYSIS  = influx_cfg.get("microServicesDataBaseName", "analysis_data")
 parsed       = urlparse(influx_cfg.get("url", "http://0.0.0.0:8086"))
 INFLUX_HOST  = parsed.hostname or "0.0.0.0"
 INFLUX_PORT  = parsed.port     or 8086
+TIERS        = influx_cfg.get("retentionTiers") or [{"name": "autogen", "duration": "INF"}]
+HIST_TIER    = pick_tier(HIST_WINDOW, TIERS)
 
 influx = InfluxDBClient(host=INFLUX_HOST, port=INFLUX_PORT)
 
 if {'name': DB_ANALYSIS} not in influx.get_list_database():
     influx.create_database(DB_ANALYSIS)
 
+def invalidate_trends():
+    """Tell the backend its cached /get_historical_trends responses are stale."""
+    try:
+        _session.post(f"{BACKEND_URL}/invalidateCache",
+                      json={"endpoints": ["get_historical_trends"]}, timeout=5)
+    except Exception as e:
+        logging.error(f"Failed invalidating trends cache: {e}")
+
 def analyze_plant(owner: str, plant: str, plant_type: str, plant_name: str):
+    """Analyze one plant and return the alerts it raised, ready for send_alerts()."""
     influx.switch_database(DB_SENSOR)
     series = {}
     for meas in METRICS:
         q = (
-            f'SELECT value FROM "{meas}" '
+            f'SELECT value FROM "{HIST_TIER}"."{meas}" '
             f"WHERE \"owner\"='{owner}' AND \"plant\"='{plant}' "
             f"AND time > now() - {HIST_WINDOW}"
         )
@@ -81,7 +159,7 @@ def analyze_plant(owner: str, plant: str, plant_type: str, plant_name: str):
             ]
     if not series:
         logging.info(f"Skipping {owner}/{plant}: no metric has >= {MIN_POINTS} points")
-        return
+        return []
 
     influx.switch_database(DB_ANALYSIS)
     now = datetime.now(timezone.utc).isoformat()
@@ -123,34 +201,39 @@ def analyze_plant(owner: str, plant: str, plant_type: str, plant_name: str):
             lo, hi = rng
             buf = (hi - lo) * BUFFER_FACTOR
             if pred < lo - buf:
-                alerts.append(
+                alerts.append((meas, "predicted_low",
                     f"[{meas}] predicted too LOW ({pred:.2f}), optimal [{lo},{hi}] (plant: {plant_name})"
-                )
+                ))
             elif pred > hi + buf:
-                alerts.append(
+                alerts.append((meas, "predicted_high",
                     f"[{meas}] predicted too HIGH ({pred:.2f}), optimal [{lo},{hi}] (plant: {plant_name})"
-                )
+                ))
         if dom_frac < 0.5:
-            alerts.append(
+            alerts.append((meas, "unstable_clusters",
                 f"[{meas}] unstable clusters (dominance {dom_frac:.2%}) (plant: {plant_name})"
-            )
+            ))
+
+    return [alert_payload(owner, plant, plant_name, meas, kind, msg) for meas, kind, msg in alerts]
 
-    for msg in alerts:
-        send_alert(owner, plant, plant_name, msg)
-        
 def main():
-    logging.info("🚀 Starting Unified Historical Analysis...")
+    logging.info(f"🚀 Starting Unified Historical Analysis (window {HIST_WINDOW} from '{HIST_TIER}')...")
     while True:
         catalog = load_catalog()
+        pending = []
         for user in catalog.get('userList', []):
             owner = user['userName']
             for pl in user.get('plantsList', []):
-                analyze_plant(
+                pending += analyze_plant(
                     owner,
                     pl['deviceConnectorSerialNumber'],
                     pl.get('plantType','').lower(),
                     pl.get('plantName', pl['deviceConnectorSerialNumber'])
                 )
+                if len(pending) >= ALERT_BATCH:
+                    send_alerts(pending)
+                    pending = []
+        send_alerts(pending)
+        invalidate_trends()
         time.sleep(HIST_INTERVAL)
 
 if __name__ == '__main__':
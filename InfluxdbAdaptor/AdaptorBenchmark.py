@@ -0,0 +1,328 @@
+"""
+Throughput benchmark for the InfluxDB adaptor ingest path.
+
+Calls InfluxDBAdaptor._on_message directly in a loop with synthetic sensor
+payloads; there is no broker, so MQTT networking and paho's own parsing are
+not measured. A local HTTP stand-in serves the catalog and accepts InfluxDB
+/write requests. Reports throughput, end-to-end latency (_on_message call ->
+point received by the fake InfluxDB), approximate per-stage timings and memory.
+
+    python AdaptorBenchmark.py --messages 100000 --plants 50 --rate 20000
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import struct
+import resource
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+MEASURES = ["temperature", "humidity", "moisture", "ph"]
+
+
+def build_catalog(num_plants, url, payload_format="json"):
+    users = []
+    for i in range(num_plants):
+        owner = f"bench{i // 3}"
+        if not users or users[-1]["userName"] != owner:
+            users.append({"userName": owner, "password": "x", "plantsList": []})
+        serial = f"{100000 + i}"
+        users[-1]["plantsList"].append({
+            "plantName": f"plant{i}",
+            "plantType": "cactus",
+            "deviceConnectorSerialNumber": serial,
+            "payloadFormat": payload_format,
+            "sensorList": [
+                {"measureType": m, "mqttTopic": f"{owner}/{serial}/{m}"} for m in MEASURES
+            ],
+            "waterTank": {"serialNumber": f"{serial}R", "mqttTopic": f"{owner}/{serial}/{serial}R"},
+        })
+    return {
+        "catalogVersion": 0,
+        "broker": {"IP": "127.0.0.1", "port": 1883},
+        "userList": users,
+        "influxdb": {"url": url, "sensorDataBaseName": "bench_measurements"},
+    }
+
+
+class FakeBackend(ThreadingHTTPServer):
+    """Serves the catalog views the adaptor reads and enough of the InfluxDB 1.x API for it."""
+    daemon_threads = True
+
+    def __init__(self, num_plants, payload_format="json"):
+        super().__init__(("127.0.0.1", 0), FakeBackendHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.catalog = build_catalog(num_plants, self.url, payload_format)
+        self.topics = [
+            {"topic": s["mqttTopic"], "owner": u["userName"], "plant": p["deviceConnectorSerialNumber"],
+             "measurement": s["measureType"], "format": payload_format}
+            for u in self.catalog["userList"] for p in u["plantsList"] for s in p["sensorList"]
+        ]
+        # An hour back, so long runs stay inside the encoder's timestamp window
+        self.base_ms = int(time.time() * 1000) - 3600 * 1000
+        self.received = {}   # seq -> perf_counter when its point reached /write
+        self.write_requests = 0
+        self.write_delay = 0.0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-backend", daemon=True).start()
+
+
+class FakeBackendHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _query(self, params):
+        q = params.get("q", [""])[0].upper()
+        if q.startswith("SHOW DATABASES"):
+            db = self.server.catalog["influxdb"]["sensorDataBaseName"]
+            series = [{"name": "databases", "columns": ["name"], "values": [[db]]}]
+            return {"results": [{"statement_id": 0, "series": series}]}
+        return {"results": [{"statement_id": 0}]}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/getCatalog":
+            self._reply(200, self.server.catalog)
+        elif url.path == "/getTopicMap":
+            self._reply(200, {"catalogVersion": 0, "topics": self.server.topics, "nextCursor": None})
+        elif url.path == "/getCatalogChanges":
+            self._reply(200, {"version": 0, "reset": False, "changes": []})
+        elif url.path == "/query":
+            self._reply(200, self._query(parse_qs(url.query)))
+        elif url.path == "/ping":
+            self._reply(204)
+        else:
+            self._reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path == "/query":
+            params = parse_qs(url.query)
+            params.update(parse_qs(body.decode()))
+            self._reply(200, self._query(params))
+        elif url.path == "/write":
+            if self.server.write_delay:
+                time.sleep(self.server.write_delay)
+            now = time.perf_counter()
+            received, base_ms = self.server.received, self.server.base_ms
+            for line in body.decode().splitlines():
+                # Each message is stamped base_ms + seq, so the timestamp identifies it
+                received[int(line.rsplit(" ", 1)[1]) - base_ms] = now
+            self.server.write_requests += 1
+            self._reply(204)
+        else:
+            self._reply(404, {"error": "Not found"})
+
+
+class FakeMessage:
+    """The two attributes of a paho MQTTMessage that _on_message reads."""
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def encode_payload(payload_format, value, ts_ms):
+    if payload_format == "text":
+        return f"{value} {ts_ms}".encode()
+    if payload_format == "struct":
+        return struct.pack("<dq", value, ts_ms)
+    if payload_format == "msgpack":
+        import msgpack
+        return msgpack.packb({"value": value, "timestamp": ts_ms})
+    return json.dumps({"value": value, "timestamp": ts_ms}).encode()
+
+
+def make_messages(topics, count, base_ms, payload_format="json"):
+    """Synthetic in-range readings, message `seq` stamped with base_ms + seq."""
+    rnd = random.Random(42)
+    return [
+        FakeMessage(rnd.choice(topics), encode_payload(payload_format, 5 + (seq % 50) / 10, base_ms + seq))
+        for seq in range(count)
+    ]
+
+
+def time_stages(adaptor, messages, codecs, validate):
+    """
+    Approximate cost per message of each _on_message stage, in microseconds.
+    Calls the same topic lookup, codec, validate_reading and encoder that
+    _on_message uses, one at a time, rather than timing inside _on_message;
+    metrics, logging and buffering are left out, so the stages do not add up
+    to the ingest throughput.
+    """
+    totals = {"decode": 0.0, "route": 0.0, "encode": 0.0}
+    for msg in messages:
+        t0 = time.perf_counter()
+        info = adaptor.topic_map.get(msg.topic)
+        t1 = time.perf_counter()
+        value, device_ts = codecs[info["format"]].decode(msg.payload)
+        value = validate(info["measurement"], value)
+        t2 = time.perf_counter()
+        adaptor.encoder.encode(info, value, device_ts)
+        t3 = time.perf_counter()
+        totals["route"] += t1 - t0
+        totals["decode"] += t2 - t1
+        totals["encode"] += t3 - t2
+    return {stage: round(total / len(messages) * 1e6, 3) for stage, total in totals.items()}
+
+
+def run(args):
+    backend = FakeBackend(args.plants, args.payload_format)
+    backend.write_delay = args.write_delay_ms / 1000
+    backend.start()
+
+    spool_dir = tempfile.mkdtemp(prefix="adaptor-bench-spool-")
+    os.environ.update({
+        "BACKEND_URL": backend.url,
+        "INFLUX_BATCH_SIZE": str(args.batch_size),
+        "INFLUX_FLUSH_INTERVAL_SEC": str(args.flush_interval),
+        "INFLUX_BUFFER_MAX_POINTS": str(args.buffer_max_points),
+        "INFLUX_WRITE_PRECISION": "ms",
+        "INFLUX_SPOOL_DIR": spool_dir,
+        "ADAPTOR_WORKERS": "1",
+    })
+    # The adaptor reads its tuning from the environment at import time
+    import InfluxdbAdaptor as ingest
+
+    rss_start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    adaptor = ingest.InfluxDBAdaptor()
+
+    writes = []
+    send = adaptor.writer._send
+
+    def timed_send(batch):
+        start = time.perf_counter()
+        try:
+            send(batch)
+        finally:
+            writes.append((time.perf_counter() - start, len(batch)))
+    adaptor.writer._send = timed_send
+
+    topics = list(adaptor.topic_map)
+    messages = make_messages(topics, args.messages, backend.base_ms, args.payload_format)
+    stages = time_stages(adaptor, messages[:min(len(messages), 20000)],
+                         ingest.CODECS, ingest.validate_reading)
+
+    # Keep the cost of any sampled debug logging but not its output
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    published = [0.0] * len(messages)
+    peak_queue = 0
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    try:
+        start = time.perf_counter()
+        next_at = start
+        for seq, msg in enumerate(messages):
+            if interval:
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            published[seq] = time.perf_counter()
+            adaptor._on_message(adaptor.mqtt_client, None, msg)
+            if seq % 1000 == 0:
+                peak_queue = max(peak_queue, adaptor.writer.queue_depth())
+        ingest_done = time.perf_counter()
+
+        deadline = ingest_done + args.drain_timeout
+        while len(backend.received) < len(messages) and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        drained = time.perf_counter()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    rss_end_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    metrics = adaptor.metrics()
+    if args.prometheus:
+        print(ingest.render_metrics(*adaptor.collect_metrics()))
+    adaptor.writer.stop()
+    backend.shutdown()
+    shutil.rmtree(spool_dir, ignore_errors=True)
+
+    latencies = sorted((backend.received[seq] - published[seq]) * 1000
+                       for seq in range(len(messages)) if seq in backend.received)
+    write_time = sum(t for t, _ in writes)
+    write_points = sum(n for _, n in writes)
+    stages["write"] = round(write_time / write_points * 1e6, 3) if write_points else 0.0
+
+    return {
+        "messages": len(messages),
+        "delivered": len(latencies),
+        "plants": args.plants,
+        "topics": len(topics),
+        "payload_format": args.payload_format,
+        "target_rate_msg_s": args.rate or None,
+        "ingest_throughput_msg_s": round(len(messages) / (ingest_done - start), 1),
+        "end_to_end_throughput_msg_s": round(len(latencies) / (drained - start), 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+        "stage_us_per_msg": stages,
+        "write_requests": backend.write_requests,
+        "memory": {
+            "max_rss_mb": round(rss_end_kb / 1024, 1),
+            "max_rss_growth_mb": round((rss_end_kb - rss_start_kb) / 1024, 1),
+            "peak_queue_depth": peak_queue,
+        },
+        "writer": metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the InfluxDB adaptor ingest path")
+    parser.add_argument("--messages", type=int, default=50000, help="synthetic messages to publish")
+    parser.add_argument("--plants", type=int, default=20, help="plants in the synthetic catalog")
+    parser.add_argument("--payload-format", default="json", choices=["json", "text", "struct", "msgpack"])
+    parser.add_argument("--rate", type=float, default=0, help="publish rate in msg/s, 0 = as fast as possible")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--buffer-max-points", type=int, default=50000)
+    parser.add_argument("--write-delay-ms", type=float, default=0, help="simulated InfluxDB write latency")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for the buffer to drain")
+    parser.add_argument("--prometheus", action="store_true", help="also print the adaptor's /metrics output")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON only")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"📊 {report['messages']} messages over {report['topics']} topics ({report['plants']} plants), "
+          f"{report['delivered']} delivered")
+    print(f"🚀 Ingest: {report['ingest_throughput_msg_s']} msg/s, "
+          f"end-to-end: {report['end_to_end_throughput_msg_s']} msg/s")
+    lat = report["latency_ms"]
+    print(f"⏱️ Latency p50={lat['p50']} ms p99={lat['p99']} ms max={lat['max']} ms")
+    print(f"🔬 Stages (µs/msg): {report['stage_us_per_msg']}")
+    print(f"💾 Memory: {report['memory']}")
+    print(f"📦 Writer: {report['writer']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,714 @@
 import os
+import re
 import json
 import datetime
 import requests
+import time
+import math
+import zlib
+import bisect
 import threading
+import itertools
+import multiprocessing
+from queue import Empty
+from collections import deque
 import paho.mqtt.client as mqtt
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
 from urllib.parse import urlparse
 import cherrypy
 
-class InfluxDBAdaptor:
+from SensorCodecs import (MEASURE_RANGES, CODECS, PayloadError, decode_reading, register_codec,
+                          validate_reading)
+
+BATCH_SIZE         = int(os.getenv("INFLUX_BATCH_SIZE", "500"))
+FLUSH_INTERVAL_SEC = float(os.getenv("INFLUX_FLUSH_INTERVAL_SEC", "1.0"))
+BUFFER_MAX_POINTS  = int(os.getenv("INFLUX_BUFFER_MAX_POINTS", "50000"))
+WRITE_PRECISION    = os.getenv("INFLUX_WRITE_PRECISION", "ms")   # 's' or 'ms'
+# Device timestamps outside [now - max age, now + max ahead] are rejected; keep the
+# age within the raw retention policy, InfluxDB refuses points older than it
+TIMESTAMP_MAX_AGE_SEC   = float(os.getenv("INFLUX_TIMESTAMP_MAX_AGE_SEC", str(48 * 3600)))
+TIMESTAMP_MAX_AHEAD_SEC = float(os.getenv("INFLUX_TIMESTAMP_MAX_AHEAD_SEC", "600"))
+SUBSCRIBE_MODE     = os.getenv("ADAPTOR_SUBSCRIBE_MODE", "topics")  # 'topics' or 'wildcard'
+WILDCARD_TOPIC     = os.getenv("ADAPTOR_WILDCARD_TOPIC", "+/+/+")
+NEGATIVE_CACHE_TTL = float(os.getenv("ADAPTOR_NEGATIVE_CACHE_TTL_SEC", "60"))
+TOPIC_MAP_PAGE_SIZE = int(os.getenv("ADAPTOR_TOPIC_MAP_PAGE_SIZE", "1000"))   # plants per /getTopicMap page
+TOPIC_LOOKUP_BATCH = 100
+CATALOG_EVENTS_TOPIC = os.getenv("CATALOG_EVENTS_TOPIC", "catalog/events")
+NUM_WORKERS        = int(os.getenv("ADAPTOR_WORKERS", "1"))
+SHARD_MODE         = os.getenv("ADAPTOR_SHARD_MODE", "shared")      # 'shared' or 'hash'
+SHARE_GROUP        = os.getenv("ADAPTOR_SHARE_GROUP", "adaptor")
+WORKER_CALL_TIMEOUT = float(os.getenv("ADAPTOR_WORKER_TIMEOUT_SEC", "10"))
+SPOOL_DIR          = os.getenv("INFLUX_SPOOL_DIR", "/app/spool")      # empty disables the spool
+SPOOL_MAX_BYTES    = int(os.getenv("INFLUX_SPOOL_MAX_BYTES", str(256 * 1024 * 1024)))
+SPOOL_EVICTION     = os.getenv("INFLUX_SPOOL_EVICTION", "drop_oldest")  # 'drop_oldest' or 'drop_newest'
+SPOOL_RETRY_SEC    = float(os.getenv("INFLUX_SPOOL_RETRY_SEC", "5"))
+SPOOL_REPLAY_INTERVAL = float(os.getenv("INFLUX_SPOOL_REPLAY_INTERVAL_SEC", "0.1"))
+SPOOL_MAX_ATTEMPTS = int(os.getenv("INFLUX_SPOOL_MAX_ATTEMPTS", "10"))   # 5xx replies before a segment is quarantined
+DEFAULT_PAYLOAD_FORMAT = os.getenv("ADAPTOR_DEFAULT_PAYLOAD_FORMAT", "json")
+DEBUG_SAMPLE_EVERY = int(os.getenv("ADAPTOR_DEBUG_SAMPLE_EVERY", "0"))  # log 1 in N messages, 0 = off
+WRITE_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Used when the catalog has no "retentionTiers": raw points in the default
+# policy, then coarser tiers each filled by a continuous query from the previous one
+DEFAULT_RETENTION_TIERS = [
+    {"name": "autogen",    "duration": "48h",  "shardDuration": "1h"},
+    {"name": "one_minute", "duration": "30d",  "interval": "1m", "resampleFor": "10m"},
+    {"name": "one_hour",   "duration": "260w", "interval": "1h", "resampleFor": "2h"},
+]
+
+
+class LineProtocolEncoder:
+    """
+    Encodes readings straight into InfluxDB line protocol.
+    The escaped "measurement,owner=..,plant=.." prefix is built once per
+    series and reused, so the hot path is a single string format.
+    Device timestamps (epoch seconds, epoch milliseconds or ISO 8601) are
+    honoured; readings without one are stamped at receive time. A device
+    timestamp more than max_age seconds old or max_ahead seconds in the future
+    (microseconds or nanoseconds read as milliseconds, junk, a skewed clock)
+    raises PayloadError("bad_timestamp"), so InfluxDB never sees a point it
+    would refuse together with the rest of its batch.
+    """
+    _MEAS_ESCAPE = str.maketrans({",": r"\,", " ": r"\ "})
+    _TAG_ESCAPE  = str.maketrans({",": r"\,", " ": r"\ ", "=": r"\="})
+
+    def __init__(self, precision=WRITE_PRECISION, max_age=TIMESTAMP_MAX_AGE_SEC,
+                 max_ahead=TIMESTAMP_MAX_AHEAD_SEC):
+        if precision not in ("s", "ms"):
+            raise ValueError(f"Unsupported write precision: {precision}")
+        self.precision = precision
+        self.max_age = max_age
+        self.max_ahead = max_ahead
+        self._scale = 1000 if precision == "ms" else 1
+        self._prefixes = {}
+
+    def prefix(self, measurement, owner, plant):
+        key = (measurement, owner, plant)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = (
+                f"{measurement.translate(self._MEAS_ESCAPE)}"
+                f",owner={str(owner).translate(self._TAG_ESCAPE)}"
+                f",plant={str(plant).translate(self._TAG_ESCAPE)}"
+            )
+            self._prefixes[key] = prefix
+        return prefix
+
+    def timestamp(self, device_ts=None):
+        """Convert a device timestamp (or now) to an integer in write precision."""
+        now = time.time()
+        if device_ts is None:
+            return int(round(now * self._scale))
+        if isinstance(device_ts, (int, float)):
+            # Values this large are already epoch milliseconds
+            seconds = device_ts / 1000 if device_ts > 1e11 else device_ts
+        else:
+            try:
+                dt = datetime.datetime.fromisoformat(str(device_ts).replace("Z", "+00:00"))
+            except ValueError:
+                raise PayloadError("bad_timestamp", f"invalid timestamp: {str(device_ts)[:32]!r}")
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=datetime.timezone.utc)
+            seconds = dt.timestamp()
+        # Also false for nan
+        if not now - self.max_age <= seconds <= now + self.max_ahead:
+            raise PayloadError("bad_timestamp", f"timestamp {device_ts!r} outside "
+                                                f"-{self.max_age:g}s/+{self.max_ahead:g}s of now")
+        return int(round(seconds * self._scale))
+
+    def encode(self, info, value, device_ts=None):
+        value = float(value)
+        # nan/inf are not valid line protocol and would make InfluxDB reject the whole batch
+        if not math.isfinite(value):
+            raise PayloadError("out_of_range", f"{info['measurement']} is not finite: {value}")
+        prefix = self.prefix(info["measurement"], info["owner"], info["plant"])
+        return f"{prefix} value={value!r} {self.timestamp(device_ts)}"
+
+
+def is_transient(error):
+    """True for write errors worth retrying: InfluxDB unreachable, timing out, 5xx or 429."""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          InfluxDBServerError)):
+        return True
+    return isinstance(error, InfluxDBClientError) and error.code == 429
+
+
+def duration_seconds(duration):
+    """Seconds in an InfluxQL duration such as "48h", "260w" or "720h0m0s"; INF and 0s are 0 (forever)."""
+    if duration.upper() == "INF":
+        return 0
+    units = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+    return sum(int(n) * units[unit] for n, unit in re.findall(r"(\d+)([wdhms])", duration))
+
+
+def downsample_select(db, source, tier, raw):
+    """
+    SELECT ... INTO `tier` FROM `source`, without WHERE/GROUP BY. A raw source
+    only has "value"; downsampled ones carry min/max along.
+    """
+    low, high = ("value", "value") if raw else ("min", "max")
+    return (
+        f'SELECT mean("value") AS "value", min("{low}") AS "min", max("{high}") AS "max" '
+        f'INTO "{db}"."{tier["name"]}".:MEASUREMENT FROM "{db}"."{source["name"]}"./.*/'
+    )
+
+
+def ensure_retention(client, db, tiers):
+    """
+    Create the retention policies and continuous queries of any tier that is
+    missing. Existing policies are never altered here: shrinking the raw one
+    deletes history, so that is left to RetentionMigrate.py, run once by hand.
+    Safe to run from every worker on every start.
+    """
+    existing = {rp["name"]: rp for rp in client.get_list_retention_policies(db)}
+    for i, tier in enumerate(tiers):
+        rp = existing.get(tier["name"])
+        if rp is None:
+            client.create_retention_policy(tier["name"], tier["duration"], 1, database=db, default=i == 0,
+                                           shard_duration=tier.get("shardDuration", "0s"))
+            print(f"⚙️ Created retention policy {tier['name']}", flush=True)
+        elif duration_seconds(rp["duration"]) != duration_seconds(tier["duration"]):
+            print(f"⚠️ Retention policy {tier['name']} keeps {rp['duration']}, configured {tier['duration']}: "
+                  f"run RetentionMigrate.py to backfill and apply it", flush=True)
+    cqs = {cq["name"] for entry in client.get_list_continuous_queries() for cq in entry.get(db, [])}
+    for source, tier in zip(tiers, tiers[1:]):
+        name = f"cq_{tier['name']}"
+        if name in cqs:
+            continue
+        select = downsample_select(db, source, tier, raw=source is tiers[0])
+        resample = f"FOR {tier['resampleFor']}" if tier.get("resampleFor") else None
+        client.create_continuous_query(name, f"{select} GROUP BY time({tier['interval']}), *",
+                                       database=db, resample_opts=resample)
+        print(f"⚙️ Created continuous query {name}", flush=True)
+    print(f"🗄️ Retention tiers: {[(t['name'], t['duration']) for t in tiers]}", flush=True)
+
+
+def apply_retention(client, db, tiers):
+    """
+    One-off migration to the configured tiers. Downsampled tiers are first
+    backfilled from the raw points still on disk, since continuous queries only
+    cover new data, and only then is every policy set to its configured
+    duration. Shrinking the raw policy deletes raw points older than it.
+    """
+    ensure_retention(client, db, tiers)
+    raw = tiers[0]
+    for tier in tiers[1:]:
+        seconds = duration_seconds(tier["duration"])
+        # Anything older than the target tier's duration would be dropped on write anyway
+        where = f" WHERE time > now() - {seconds}s" if seconds else ""
+        client.query(f"{downsample_select(db, raw, tier, raw=True)}{where} "
+                     f"GROUP BY time({tier['interval']}), * fill(none)", database=db)
+        print(f"📥 Backfilled {tier['name']} from {raw['name']}", flush=True)
+    for i, tier in enumerate(tiers):
+        client.alter_retention_policy(tier["name"], database=db, duration=tier["duration"],
+                                      default=i == 0, shard_duration=tier.get("shardDuration"))
+        print(f"⚙️ Retention policy {tier['name']} set to {tier['duration']}", flush=True)
+
+
+class WriteSpool:
+    """
+    Append-only on-disk spool for batches InfluxDB could not take.
+    Each failed batch becomes one segment file of line protocol, named by an
+    increasing sequence number, so segments survive restarts and are replayed
+    oldest first. A replayer thread retries the oldest segment every
+    SPOOL_RETRY_SEC while InfluxDB is down, then drains the rest, pausing
+    SPOOL_REPLAY_INTERVAL between segments and whenever the live buffer is busy.
+    Live batches keep going straight to InfluxDB while the spool drains, so
+    recent points can land before older spooled ones; points carry their own
+    timestamps, so only the write order differs.
+    A segment InfluxDB rejects with a 4xx, or that gets max_attempts 5xx
+    replies, is moved to quarantine/ so it cannot block the segments behind it.
+    Past max_bytes the eviction policy either deletes the oldest segments or
+    refuses the new batch.
+    """
+    def __init__(self, directory, write, busy=lambda: False, max_bytes=SPOOL_MAX_BYTES,
+                 eviction=SPOOL_EVICTION, retry_sec=SPOOL_RETRY_SEC,
+                 replay_interval=SPOOL_REPLAY_INTERVAL, max_attempts=SPOOL_MAX_ATTEMPTS):
+        if eviction not in ("drop_oldest", "drop_newest"):
+            raise ValueError(f"Unsupported spool eviction policy: {eviction}")
+        self.directory = directory
+        self.write = write
+        self.busy = busy
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.retry_sec = retry_sec
+        self.replay_interval = replay_interval
+        self.max_attempts = max_attempts
+        self.quarantine_dir = os.path.join(directory, "quarantine")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+        self._segments = deque()    # (seq, size, points) oldest first
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".lp"):
+                path = os.path.join(directory, name)
+                with open(path, encoding="utf-8") as f:
+                    points = sum(1 for line in f if line.strip())
+                self._segments.append((int(name[:-3]), os.path.getsize(path), points))
+            elif name.endswith(".tmp"):
+                os.remove(os.path.join(directory, name))
+        # Quarantined segments keep their sequence numbers, so never reuse one
+        quarantined = [int(name[:-3]) for name in os.listdir(self.quarantine_dir)
+                       if name.endswith(".lp")] if os.path.isdir(self.quarantine_dir) else []
+        self._next_seq = max([seq for seq, _, _ in self._segments] + quarantined, default=-1) + 1
+        self._bytes = sum(size for _, size, _ in self._segments)
+        self.metrics = {
+            "points_spooled": 0,
+            "points_replayed": 0,
+            "points_evicted": 0,
+            "points_quarantined": 0,
+            "replay_errors": 0,
+        }
+        if self._segments:
+            print(f"💾 Spool has {len(self._segments)} segments pending in {directory}", flush=True)
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.lp")
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="influx-replayer", daemon=True)
+        self._thread.start()
+
+    def append(self, batch):
+        """Persist a failed batch as a new segment. Returns False if it was refused."""
+        data = ("\n".join(batch) + "\n").encode("utf-8")
+        with self._lock:
+            while self._bytes + len(data) > self.max_bytes:
+                if self.eviction == "drop_newest" or not self._segments:
+                    self.metrics["points_evicted"] += len(batch)
+                    return False
+                seq, size, points = self._segments.popleft()
+                self._remove(seq)
+                self._bytes -= size
+                self.metrics["points_evicted"] += points
+            seq = self._next_seq
+            self._next_seq += 1
+            tmp = self._path(seq) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path(seq))
+            self._segments.append((seq, len(data), len(batch)))
+            self._bytes += len(data)
+            self.metrics["points_spooled"] += len(batch)
+        self._wake.set()
+        return True
+
+    def _remove(self, seq):
+        try:
+            os.remove(self._path(seq))
+        except FileNotFoundError:
+            pass
+
+    def quarantine(self, batch, reason):
+        """Set aside a batch InfluxDB will never accept, for someone to inspect."""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            os.makedirs(self.quarantine_dir, exist_ok=True)
+            with open(os.path.join(self.quarantine_dir, f"{seq:012d}.lp"), "w", encoding="utf-8") as f:
+                f.write("\n".join(batch) + "\n")
+            self.metrics["points_quarantined"] += len(batch)
+        print(f"🚫 Quarantined {len(batch)} points as {seq:012d}.lp: {reason}", flush=True)
+
+    def _quarantine_head(self, seq, size, points, reason):
+        with self._lock:
+            if not self._segments or self._segments[0][0] != seq:
+                return
+            self._segments.popleft()
+            self._bytes -= size
+            os.makedirs(self.quarantine_dir, exist_ok=True)
+            try:
+                os.replace(self._path(seq), os.path.join(self.quarantine_dir, f"{seq:012d}.lp"))
+            except FileNotFoundError:
+                return
+            self.metrics["points_quarantined"] += points
+        print(f"🚫 Quarantined spool segment {seq:012d}.lp ({points} points): {reason}", flush=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics, spool_segments=len(self._segments), spool_bytes=self._bytes)
+
+    def _run(self):
+        attempts = (None, 0)    # (head seq, 5xx replies so far)
+        while not self._stopped.is_set():
+            with self._lock:
+                head = self._segments[0] if self._segments else None
+            if head is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            if self.busy():
+                self._stopped.wait(self.replay_interval)
+                continue
+            seq, size, points = head
+            try:
+                with open(self._path(seq), encoding="utf-8") as f:
+                    batch = [line.rstrip("\n") for line in f if line.strip()]
+                if batch:
+                    self.write(batch)
+            except FileNotFoundError:
+                batch = []
+            except Exception as e:
+                self.metrics["replay_errors"] += 1
+                if not is_transient(e):
+                    self._quarantine_head(seq, size, points, e)
+                    continue
+                # Connection errors only mean InfluxDB is down; server errors may be this segment
+                if isinstance(e, InfluxDBServerError):
+                    count = attempts[1] + 1 if attempts[0] == seq else 1
+                    attempts = (seq, count)
+                    if count >= self.max_attempts:
+                        self._quarantine_head(seq, size, points, f"{count} server errors, last: {e}")
+                        continue
+                print(f"⚠️ Spool replay failed, retrying in {self.retry_sec}s: {e}", flush=True)
+                self._stopped.wait(self.retry_sec)
+                continue
+            with self._lock:
+                # The segment may have been evicted while it was being written
+                if self._segments and self._segments[0][0] == seq:
+                    self._segments.popleft()
+                    self._bytes -= size
+                    self._remove(seq)
+                    self.metrics["points_replayed"] += len(batch)
+            self._stopped.wait(self.replay_interval)
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense; observe() is a bisect and two adds."""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    In-memory counters and histograms keyed by (name, labels), plus gauge
+    callbacks read at scrape time, so the hot path is a single dict update.
+    collect() returns plain tuples that can cross process boundaries and be
+    rendered in the Prometheus text format by render_metrics().
+    """
     def __init__(self):
+        self._families = {}     # name -> (type, help)
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> Histogram
+        self._collectors = []   # callables returning [(name, labels, value)]
+
+    def describe(self, name, kind, help_text):
+        self._families[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=(), buckets=WRITE_LATENCY_BUCKETS):
+        hist = self._histograms.get((name, labels))
+        if hist is None:
+            hist = self._histograms[(name, labels)] = Histogram(buckets)
+        hist.observe(value)
+
+    def counter_values(self, name):
+        return {labels: value for (n, labels), value in list(self._counters.items()) if n == name}
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def collect(self):
+        """Snapshot as (families, samples); each sample is (family, name, labels, value)."""
+        samples = [(name, name, labels, value) for (name, labels), value in list(self._counters.items())]
+        for (name, labels), hist in list(self._histograms.items()):
+            cumulative = 0
+            for bound, count in zip(hist.buckets + (float("inf"),), list(hist.counts)):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((name, f"{name}_bucket", labels + (("le", le),), cumulative))
+            samples.append((name, f"{name}_sum", labels, hist.sum))
+            samples.append((name, f"{name}_count", labels, hist.count))
+        for collector in self._collectors:
+            samples.extend((name, name, labels, value) for name, labels, value in collector())
+        return dict(self._families), samples
+
+
+_LABEL_ESCAPE = str.maketrans({"\\": r"\\", '"': r'\"', "\n": r"\n"})
+
+
+def render_metrics(families, samples):
+    """Prometheus text exposition format (version 0.0.4)."""
+    def label_text(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{str(v).translate(_LABEL_ESCAPE)}"' for k, v in labels) + "}"
+
+    by_family = {}
+    for family, name, labels, value in samples:
+        by_family.setdefault(family, []).append(f"{name}{label_text(labels)} {float(value)!r}")
+    lines = []
+    for family, (kind, help_text) in families.items():
+        if family not in by_family:
+            continue
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        lines.extend(by_family[family])
+    return "\n".join(lines) + "\n"
+
+
+class BatchWriter:
+    """
+    Bounded write buffer in front of InfluxDB.
+    Points are queued from the MQTT thread and written by a separate flusher
+    thread once BATCH_SIZE points are pending or the oldest one is older than
+    FLUSH_INTERVAL_SEC. When the buffer is full the oldest point is dropped.
+    Points are pre-encoded line protocol strings in the given precision.
+    With a spool_dir, batches that fail because InfluxDB is unreachable or
+    answers 5xx are spooled to disk and replayed later instead of being
+    dropped; batches it rejects outright (4xx) are quarantined.
+    """
+    def __init__(self, client, precision=WRITE_PRECISION, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL_SEC, max_points=BUFFER_MAX_POINTS, spool_dir=None,
+                 registry=None):
+        self.client = client
+        self.registry = registry
+        self.precision = precision
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_points = max_points
+        self._buffer = deque()
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.metrics = {
+            "points_written": 0,
+            "points_dropped": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_batch_size": 0,
+            "last_flush_latency_ms": 0.0,
+            "max_flush_latency_ms": 0.0,
+        }
+        self.spool = None
+        if spool_dir:
+            try:
+                self.spool = WriteSpool(spool_dir, self._send,
+                                        busy=lambda: self.queue_depth() >= self.batch_size)
+            except OSError as e:
+                print(f"⚠️ Spool disabled, cannot use {spool_dir}: {e}", flush=True)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="influx-flusher", daemon=True)
+        self._thread.start()
+        if self.spool:
+            self.spool.start()
+
+    def add(self, point):
+        with self._cond:
+            if len(self._buffer) >= self.max_points:
+                self._buffer.popleft()
+                self.metrics["points_dropped"] += 1
+            was_empty = not self._buffer
+            if was_empty:
+                self._oldest = time.monotonic()
+            self._buffer.append(point)
+            if was_empty or len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def queue_depth(self):
+        return len(self._buffer)
+
+    def _take_batch(self):
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        self._oldest = time.monotonic() if self._buffer else None
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if len(self._buffer) >= self.batch_size:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.flush_interval - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if not self._running:
+                    return
+                batch = self._take_batch()
+            self._write(batch)
+
+    def _send(self, batch):
+        self.client.write_points(batch, time_precision=self.precision, protocol="line")
+
+    def _write(self, batch):
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            self._send(batch)
+            self.metrics["points_written"] += len(batch)
+        except Exception as e:
+            self.metrics["flush_errors"] += 1
+            print(f"❌ InfluxDB batch write error ({len(batch)} points): {e}", flush=True)
+            spooled = False
+            if self.spool:
+                try:
+                    if is_transient(e):
+                        spooled = self.spool.append(batch)
+                    else:
+                        # Replaying a batch InfluxDB refuses would only block the spool
+                        self.spool.quarantine(batch, e)
+                except OSError as e:
+                    print(f"❌ Spool write error: {e}", flush=True)
+            if not spooled:
+                self.metrics["points_dropped"] += len(batch)
+        latency = (time.perf_counter() - start) * 1000
+        if self.registry is not None:
+            self.registry.observe("adaptor_write_latency_seconds", latency / 1000)
+        self.metrics["flushes"] += 1
+        self.metrics["last_batch_size"] = len(batch)
+        self.metrics["last_flush_latency_ms"] = round(latency, 3)
+        self.metrics["max_flush_latency_ms"] = round(max(self.metrics["max_flush_latency_ms"], latency), 3)
+
+    def stats(self):
+        stats = dict(self.metrics, queue_depth=self.queue_depth())
+        if self.spool:
+            stats.update(self.spool.stats())
+        return stats
+
+    def stop(self, timeout=10):
+        """Stop the flusher thread and drain whatever is still buffered."""
+        if self.spool:
+            self.spool.stop(timeout=timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch:
+                break
+            self._write(batch)
+        print(f"🛑 Batch writer drained: {self.stats()}", flush=True)
+
+
+class InfluxDBAdaptor:
+    def __init__(self, worker_id=0, num_workers=1, shard_mode=SHARD_MODE):
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.shard_mode = shard_mode if num_workers > 1 else None
         self.backend_url = os.getenv("BACKEND_URL", "http://backend:8080")
         self.catalog_api = f"{self.backend_url.rstrip('/')}/getCatalog"
+        self.topic_map_api = f"{self.backend_url.rstrip('/')}/getTopicMap"
+        self.changes_api = f"{self.backend_url.rstrip('/')}/getCatalogChanges"
 
-        print(f"📦 Fetching catalog from {self.catalog_api}...", flush=True)
-        self.catalog = self._fetch_catalog()
+        print(f"📦 Fetching configuration from {self.catalog_api}...", flush=True)
+        self.catalog = self._fetch_config()
+        self.catalog_version = 0
 
         broker_cfg = self.catalog.get("broker", {})
         self.mqtt_host = broker_cfg.get("IP", "localhost")
         self.mqtt_port = broker_cfg.get("port", 1883)
 
         self._init_influx_db()
+        self.encoder = LineProtocolEncoder()
+        self.registry = MetricsRegistry()
+        self._init_metrics()
+        spool_dir = os.path.join(SPOOL_DIR, f"worker-{worker_id}") if SPOOL_DIR else None
+        self.writer = BatchWriter(self.influx_client, precision=self.encoder.precision, spool_dir=spool_dir,
+                                  registry=self.registry)
+        self.writer.start()
         self.topic_map = self._build_topic_map()
+        self._plant_topics = self._index_plants(self.topic_map)
+
+        self.subscribe_mode = SUBSCRIBE_MODE
+        if self.shard_mode == "hash" and self.subscribe_mode == "wildcard":
+            print("⚠️ Hash sharding needs per-topic subscriptions, ignoring wildcard mode", flush=True)
+            self.subscribe_mode = "topics"
+        self._unknown_topics = {}   # topic -> monotonic time until which it is known to be unmapped
+        self._pending_topics = set()
+        self._resolving = False
+        self._resolve_lock = threading.Lock()
+        self._refresh_lock = threading.RLock()
 
         self.mqtt_client = mqtt.Client()
         self.mqtt_client.on_connect = self._on_connect
         self.mqtt_client.on_message = self._on_message
+        self.mqtt_client.message_callback_add(CATALOG_EVENTS_TOPIC, self._on_catalog_event)
 
-    def _fetch_catalog(self):
-        resp = requests.get(self.catalog_api, timeout=5)
+    def _fetch_config(self):
+        """The catalog's broker and InfluxDB sections; topics come from /getTopicMap."""
+        resp = requests.get(self.catalog_api, params={"fields": "broker,influxdb"}, timeout=5)
         resp.raise_for_status()
-        catalog = resp.json()
-        print(f"✅ Catalog loaded: users={len(catalog.get('userList', []))}, broker={catalog.get('broker')}", flush=True)
-        return catalog
+        config = resp.json()
+        print(f"✅ Configuration loaded: broker={config.get('broker')}", flush=True)
+        return config
+
+    def _fetch_topic_map(self):
+        """
+        (catalogVersion, topic map) from the paged /getTopicMap view. The version
+        is the first page's, so changes made while paging are replayed by the
+        next change-feed pull.
+        """
+        version, topic_map = None, {}
+        params = {"limit": TOPIC_MAP_PAGE_SIZE}
+        while True:
+            resp = requests.get(self.topic_map_api, params=params, timeout=5)
+            resp.raise_for_status()
+            page = resp.json()
+            if version is None:
+                version = page.get("catalogVersion", 0)
+            topic_map.update(self._topic_entries(page.get("topics", [])))
+            if not page.get("nextCursor"):
+                return version, topic_map
+            params["cursor"] = page["nextCursor"]
+
+    def _lookup_topics(self, topics):
+        """Topic map restricted to the given topics, for resolving unmapped ones."""
+        topics, topic_map = sorted(topics), {}
+        for i in range(0, len(topics), TOPIC_LOOKUP_BATCH):
+            resp = requests.get(self.topic_map_api, params={"topic": topics[i:i + TOPIC_LOOKUP_BATCH]}, timeout=5)
+            resp.raise_for_status()
+            topic_map.update(self._topic_entries(resp.json().get("topics", [])))
+        return topic_map
+
+    def _topic_entries(self, entries):
+        """Series metadata of /getTopicMap entries whose plant this worker owns."""
+        topic_map = {}
+        for entry in entries:
+            if self.shard_mode == "hash" and not self._owns_plant(entry["plant"]):
+                continue
+            info = {"owner": entry["owner"], "plant": entry["plant"], "measurement": entry["measurement"],
+                    "format": entry.get("format", DEFAULT_PAYLOAD_FORMAT)}
+            if info["format"] not in CODECS:
+                print(f"⚠️ Unsupported payload format '{info['format']}' for {entry['topic']}, "
+                      f"readings will be rejected", flush=True)
+            topic_map[entry["topic"]] = info
+        return topic_map
 
     def _init_influx_db(self):
         influx_cfg = self.catalog.get("influxdb", {})
@@ -48,108 +724,452 @@ class InfluxDBAdaptor:
             client.create_database(self.db_name)
         self.influx_client = client
         self.influx_client.switch_database(self.db_name)
+        try:
+            ensure_retention(client, self.db_name, influx_cfg.get("retentionTiers", DEFAULT_RETENTION_TIERS))
+        except Exception as e:
+            print(f"⚠️ Could not set up retention tiers: {e}", flush=True)
+
+    def _init_metrics(self):
+        self._received = 0
+        self._last_seen = {}    # (owner, plant) -> epoch seconds of the last stored reading
+        for name, kind, help_text in [
+            ("adaptor_messages_total", "counter", "MQTT messages received on mapped topics, by measurement"),
+            ("adaptor_unmapped_messages_total", "counter", "MQTT messages on topics missing from the topic map"),
+            ("adaptor_rejected_total", "counter", "Readings rejected and not stored, by reason"),
+            ("adaptor_write_latency_seconds", "histogram", "InfluxDB batch write latency"),
+            ("adaptor_points_written_total", "counter", "Points written to InfluxDB"),
+            ("adaptor_points_dropped_total", "counter", "Points lost to buffer overflow or failed writes"),
+            ("adaptor_flushes_total", "counter", "Batch flushes attempted"),
+            ("adaptor_flush_errors_total", "counter", "Batch flushes InfluxDB rejected"),
+            ("adaptor_queue_depth", "gauge", "Points waiting in the write buffer"),
+            ("adaptor_spool_segments", "gauge", "Failed batches waiting on disk for replay"),
+            ("adaptor_spool_bytes", "gauge", "Size of the on-disk spool"),
+            ("adaptor_points_quarantined_total", "counter", "Points InfluxDB refused, set aside in the spool quarantine"),
+            ("adaptor_topics", "gauge", "Topics in the topic map"),
+            ("adaptor_plant_last_seen_timestamp_seconds", "gauge", "Time of the last stored reading per plant"),
+        ]:
+            self.registry.describe(name, kind, help_text)
+        self.registry.register_collector(self._collect_gauges)
+
+    def _collect_gauges(self):
+        stats = self.writer.stats()
+        samples = [
+            ("adaptor_points_written_total", (), stats["points_written"]),
+            ("adaptor_points_dropped_total", (), stats["points_dropped"]),
+            ("adaptor_flushes_total", (), stats["flushes"]),
+            ("adaptor_flush_errors_total", (), stats["flush_errors"]),
+            ("adaptor_queue_depth", (), stats["queue_depth"]),
+            ("adaptor_topics", (), len(self.topic_map)),
+        ]
+        if "spool_segments" in stats:
+            samples.append(("adaptor_spool_segments", (), stats["spool_segments"]))
+            samples.append(("adaptor_spool_bytes", (), stats["spool_bytes"]))
+            samples.append(("adaptor_points_quarantined_total", (), stats["points_quarantined"]))
+        for (owner, plant), seen in list(self._last_seen.items()):
+            samples.append(("adaptor_plant_last_seen_timestamp_seconds",
+                            (("owner", owner), ("plant", plant)), seen))
+        return samples
+
+    def _debug(self, text):
+        """Per-message log line, printed for 1 in ADAPTOR_DEBUG_SAMPLE_EVERY messages."""
+        if DEBUG_SAMPLE_EVERY and self._received % DEBUG_SAMPLE_EVERY == 0:
+            print(text, flush=True)
 
     def _build_topic_map(self):
-        topic_map = {}
-        for user in self.catalog.get("userList", []):
-            owner = user.get("userName")
-            for plant in user.get("plantsList", []):
-                pid = plant.get("deviceConnectorSerialNumber")
-                for sensor in plant.get("sensorList", []):
-                    t = sensor.get("mqttTopic")
-                    m = sensor.get("measureType", "").strip().lower()
-                    if t and m:
-                        topic_map[t] = {"owner": owner, "plant": pid, "measurement": m}
-                tank = plant.get("waterTank")
-                if tank and tank.get("mqttTopic"):
-                    t = tank.get("mqttTopic")
-                    topic_map[t] = {"owner": owner, "plant": pid, "measurement": "watertank"}
+        self.catalog_version, topic_map = self._fetch_topic_map()
         print(f"📡 Topics to subscribe: {list(topic_map.keys())}", flush=True)
         return topic_map
 
+    def _owns_plant(self, plant):
+        """Hash sharding: a plant belongs to exactly one worker, stable across processes."""
+        return zlib.crc32(str(plant).encode()) % self.num_workers == self.worker_id
+
+    def _sub_topic(self, topic):
+        """Topic filter to subscribe with; shared mode lets the broker balance workers."""
+        if self.shard_mode == "shared":
+            return f"$share/{SHARE_GROUP}/{topic}"
+        return topic
+
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"✅ Connected to MQTT broker at {self.mqtt_host}:{self.mqtt_port}", flush=True)
-            for t in self.topic_map:
-                client.subscribe(t)
-                print(f"🔔 Subscribed to: {t}", flush=True)
+            # Not shared: every worker keeps its own topic map current
+            client.subscribe(CATALOG_EVENTS_TOPIC, qos=1)
+            if self.subscribe_mode == "wildcard":
+                client.subscribe(self._sub_topic(WILDCARD_TOPIC))
+                print(f"🔔 Subscribed to wildcard: {self._sub_topic(WILDCARD_TOPIC)}", flush=True)
+            elif self.topic_map:
+                client.subscribe([(self._sub_topic(t), 0) for t in self.topic_map])
+                print(f"🔔 Subscribed to {len(self.topic_map)} topics", flush=True)
         else:
             print(f"❌ MQTT connection failed (code {rc})", flush=True)
 
+    def _resolve_unknown(self, topic):
+        """Queue an unmapped topic for a catalog lookup unless it is negatively cached."""
+        expiry = self._unknown_topics.get(topic)
+        if expiry is not None and expiry > time.monotonic():
+            return
+        with self._resolve_lock:
+            self._pending_topics.add(topic)
+            if self._resolving:
+                return
+            self._resolving = True
+        threading.Thread(target=self._resolve_pending, daemon=True).start()
+
+    def _resolve_pending(self):
+        """Look up all pending topics with one topic-map query."""
+        with self._resolve_lock:
+            pending, self._pending_topics = self._pending_topics, set()
+        try:
+            new_map = self._lookup_topics(pending)
+        except Exception as e:
+            print(f"⚠️ Catalog lookup failed: {e}", flush=True)
+            new_map = {}
+        with self._resolve_lock:
+            # Topics queued during the lookup get a lookup of their own
+            self._resolving = again = bool(self._pending_topics)
+        now = time.monotonic()
+        # Same maps refresh_subscriptions() rewrites from the REST and catalog event threads
+        with self._refresh_lock:
+            for t, expiry in list(self._unknown_topics.items()):
+                if expiry <= now:
+                    self._unknown_topics.pop(t, None)
+            for t in pending:
+                if t in new_map:
+                    self.topic_map[t] = new_map[t]
+                    info = new_map[t]
+                    self._plant_topics.setdefault((info["owner"], info["plant"]), set()).add(t)
+                    print(f"🔔 Resolved new topic: {t}", flush=True)
+                else:
+                    self._unknown_topics[t] = now + NEGATIVE_CACHE_TTL
+        if again:
+            threading.Thread(target=self._resolve_pending, daemon=True).start()
+
+    def _on_catalog_event(self, client, userdata, msg):
+        """A catalog commit pushed by the backend; applied off the network thread."""
+        try:
+            message = json.loads(msg.payload)
+        except ValueError:
+            return
+        if message.get("version", 0) > self.catalog_version:
+            threading.Thread(target=self._apply_catalog_event, args=(message,), daemon=True).start()
+
+    def _apply_catalog_event(self, message):
+        """Apply the next version's events directly; after a gap, replay from the change feed."""
+        try:
+            with self._refresh_lock:
+                if message["version"] <= self.catalog_version:
+                    return
+                if message["version"] == self.catalog_version + 1:
+                    self.refresh_subscriptions({"version": message["version"], "changes": message.get("events", [])})
+                else:
+                    self.refresh_subscriptions()
+        except Exception as e:
+            print(f"⚠️ Failed to apply catalog event {message.get('version')}: {e}", flush=True)
+
     def _on_message(self, client, userdata, msg):
+        self._received += 1
         info = self.topic_map.get(msg.topic)
         if not info:
+            self.registry.inc("adaptor_unmapped_messages_total")
+            if self.subscribe_mode == "wildcard":
+                self._resolve_unknown(msg.topic)
             return
+        self.registry.inc("adaptor_messages_total", (("measurement", info["measurement"]),))
         try:
-            payload = json.loads(msg.payload.decode())
-            value = float(payload.get("value", 0))
-        except Exception as e:
-            print(f"⚠️ Invalid payload on {msg.topic}: {e}", flush=True)
+            value, device_ts = decode_reading(msg.payload, info["format"], info["measurement"])
+            line = self.encoder.encode(info, value, device_ts)
+        except PayloadError as e:
+            self.registry.inc("adaptor_rejected_total", (("reason", e.reason),))
+            self._debug(f"⚠️ Rejected payload on {msg.topic}: {e}")
             return
-        point = {
-            "measurement": info['measurement'],
-            "tags": {"owner": info['owner'], "plant": info['plant']},
-            "time": datetime.datetime.utcnow().isoformat(),
-            "fields": {"value": value}
-        }
+        except (ValueError, TypeError, OverflowError) as e:
+            # Device timestamp of an unexpected type
+            self.registry.inc("adaptor_rejected_total", (("reason", "decode"),))
+            self._debug(f"⚠️ Rejected payload on {msg.topic}: {e}")
+            return
+        self.writer.add(line)
+        self._last_seen[(info["owner"], info["plant"])] = time.time()
+        self._debug(f"📥 Queued {info['measurement']}={value} for {info['owner']}/{info['plant']}")
+
+    def start(self):
+        """Connect to the broker and run the MQTT loop on a background thread."""
+        threading.Thread(
+            target=lambda: (
+                self.mqtt_client.connect(self.mqtt_host, self.mqtt_port, keepalive=60),
+                self.mqtt_client.loop_forever()
+            ), daemon=True
+        ).start()
+
+    def metrics(self):
+        stats = self.writer.stats()
+        stats["messages_received"] = self._received
+        for labels, count in self.registry.counter_values("adaptor_rejected_total").items():
+            stats[f"rejected_{dict(labels)['reason']}"] = count
+        return stats
+
+    def collect_metrics(self):
+        return self.registry.collect()
+
+    def stop(self):
+        """Disconnect from MQTT and drain the write buffer."""
         try:
-            self.influx_client.write_points([point])
-            print(f"📥 Wrote {info['measurement']}={value} for {info['owner']}/{info['plant']}", flush=True)
+            self.mqtt_client.disconnect()
         except Exception as e:
-            print(f"❌ InfluxDB write error: {e}", flush=True)
+            print(f"⚠️ MQTT disconnect error: {e}", flush=True)
+        self.writer.stop()
 
-    def refresh_subscriptions(self):
-        """Fetch the catalog and subscribe to any new topics"""
-        new_catalog = self._fetch_catalog()
-        new_map = self._build_topic_map_from_catalog(new_catalog)
-        added = set(new_map.keys()) - set(self.topic_map.keys())
-        for t in added:
+    def _fetch_changes(self):
+        resp = requests.get(self.changes_api, params={"since": self.catalog_version}, timeout=5)
+        resp.raise_for_status()
+        return resp.json()
+
+    def refresh_subscriptions(self, delta=None):
+        """
+        Apply catalog changes since the last seen version, pulled from the
+        change feed unless a pushed `delta` is given: subscribe to added
+        topics, unsubscribe from removed ones and update metadata of the rest
+        in place. Falls back to diffing the full topic map when the backend no
+        longer has the changes (or has no change feed).
+        """
+        with self._refresh_lock:
+            return self._refresh_subscriptions(delta)
+
+    def _refresh_subscriptions(self, delta):
+        if delta is None:
             try:
-                self.mqtt_client.subscribe(t)
-                self.topic_map[t] = new_map[t]
-                print(f"🔔 Dynamically subscribed to new topic: {t}", flush=True)
+                delta = self._fetch_changes()
             except Exception as e:
-                print(f"❌ Failed to subscribe to {t}: {e}", flush=True)
-        return list(added)
+                print(f"⚠️ Catalog change feed unavailable, diffing full topic map: {e}", flush=True)
+                delta = {"reset": True}
+        if delta.get("reset"):
+            version, new_map = self._fetch_topic_map()
+            removed = set(self.topic_map) - set(new_map)
+            self._plant_topics = self._index_plants(new_map)
+            self.catalog_version = version
+        else:
+            new_map, removed = {}, set()
+            for change in delta.get("changes", []):
+                if "plantSerial" not in change:
+                    continue    # user_added / user_removed carry no topics of their own
+                key = (change["userName"], change["plantSerial"])
+                old_topics = self._plant_topics.get(key, set())
+                plant_map = {}
+                if change["op"] == "upsert":
+                    plant_map = self._plant_topic_map(change["userName"], change["plant"])
+                for t in old_topics - set(plant_map):
+                    new_map.pop(t, None)
+                    removed.add(t)
+                for t, info in plant_map.items():
+                    new_map[t] = info
+                    removed.discard(t)
+                if plant_map:
+                    self._plant_topics[key] = set(plant_map)
+                else:
+                    self._plant_topics.pop(key, None)
+            self.catalog_version = delta.get("version", self.catalog_version)
 
-    def _build_topic_map_from_catalog(self, catalog):
+        added = [t for t in new_map if t not in self.topic_map]
+        updated = [t for t in new_map if t in self.topic_map and self.topic_map[t] != new_map[t]]
+        for t in updated:
+            self.topic_map[t] = new_map[t]
+        for t in removed:
+            self.topic_map.pop(t, None)
+        if self.subscribe_mode == "wildcard":
+            for t in added:
+                self.topic_map[t] = new_map[t]
+                self._unknown_topics.pop(t, None)
+        else:
+            if removed:
+                try:
+                    self.mqtt_client.unsubscribe([self._sub_topic(t) for t in removed])
+                    print(f"🔕 Unsubscribed from {len(removed)} removed topics", flush=True)
+                except Exception as e:
+                    print(f"❌ Failed to unsubscribe from {sorted(removed)}: {e}", flush=True)
+            for t in added:
+                try:
+                    self.mqtt_client.subscribe(self._sub_topic(t))
+                    self.topic_map[t] = new_map[t]
+                    print(f"🔔 Dynamically subscribed to new topic: {t}", flush=True)
+                except Exception as e:
+                    print(f"❌ Failed to subscribe to {t}: {e}", flush=True)
+        return {"new_topics": added, "removed_topics": sorted(removed), "updated_topics": updated}
+
+    def _plant_topic_map(self, owner, plant):
+        """
+        Topics of one plant mapped to their series metadata. The payload format
+        comes from the sensor's "payloadFormat", then the plant's, then the default.
+        """
+        pid = plant.get("deviceConnectorSerialNumber")
+        if self.shard_mode == "hash" and not self._owns_plant(pid):
+            return {}
+        plant_format = plant.get("payloadFormat", DEFAULT_PAYLOAD_FORMAT)
         topic_map = {}
-        for user in catalog.get("userList", []):
-            owner = user.get("userName")
-            for plant in user.get("plantsList", []):
-                pid = plant.get("deviceConnectorSerialNumber")
-                for sensor in plant.get("sensorList", []):
-                    t = sensor.get("mqttTopic")
-                    m = sensor.get("measureType", "").strip().lower()
-                    if t and m:
-                        topic_map[t] = {"owner": owner, "plant": pid, "measurement": m}
-                tank = plant.get("waterTank")
-                if tank and tank.get("mqttTopic"):
-                    t = tank.get("mqttTopic")
-                    topic_map[t] = {"owner": owner, "plant": pid, "measurement": "watertank"}
+        for sensor in plant.get("sensorList", []):
+            t = sensor.get("mqttTopic")
+            m = sensor.get("measureType", "").strip().lower()
+            if t and m:
+                fmt = sensor.get("payloadFormat", plant_format)
+                topic_map[t] = {"owner": owner, "plant": pid, "measurement": m, "format": fmt}
+        tank = plant.get("waterTank")
+        if tank and tank.get("mqttTopic"):
+            t = tank.get("mqttTopic")
+            fmt = tank.get("payloadFormat", plant_format)
+            topic_map[t] = {"owner": owner, "plant": pid, "measurement": "watertank", "format": fmt}
+        for t, info in topic_map.items():
+            if info["format"] not in CODECS:
+                print(f"⚠️ Unsupported payload format '{info['format']}' for {t}, readings will be rejected", flush=True)
         return topic_map
 
+    @staticmethod
+    def _index_plants(topic_map):
+        """Group mapped topics by (owner, plant) so a plant change touches only its own topics."""
+        plant_topics = {}
+        for t, info in topic_map.items():
+            plant_topics.setdefault((info["owner"], info["plant"]), set()).add(t)
+        return plant_topics
+
+
+def run_worker(worker_id, num_workers, control, results):
+    """Entry point of a sharded worker process: one adaptor with its own Influx client and writer."""
+    adaptor = InfluxDBAdaptor(worker_id=worker_id, num_workers=num_workers)
+    adaptor.start()
+    print(f"👷 Worker {worker_id}/{num_workers} started ({adaptor.shard_mode})", flush=True)
+    while True:
+        msg = control.get()
+        if msg == "stop":
+            break
+        # Echo the request id so the pool can drop replies to calls it already gave up on
+        request_id, cmd = msg
+        try:
+            if cmd == "refresh":
+                results.put((request_id, worker_id, adaptor.refresh_subscriptions()))
+            elif cmd == "metrics":
+                results.put((request_id, worker_id, adaptor.metrics()))
+            elif cmd == "collect":
+                results.put((request_id, worker_id, adaptor.collect_metrics()))
+        except Exception as e:
+            results.put((request_id, worker_id, {"error": str(e)}))
+    adaptor.stop()
+
+
+class WorkerPool:
+    """
+    Runs N adaptor processes and fans control calls out to all of them.
+    Exposes the same refresh_subscriptions()/metrics() as a single adaptor.
+    """
+    def __init__(self, num_workers=NUM_WORKERS):
+        self.num_workers = num_workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._controls = []
+        self._procs = []
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+
+    def start(self):
+        for i in range(self.num_workers):
+            control = self._ctx.Queue()
+            proc = self._ctx.Process(
+                target=run_worker, args=(i, self.num_workers, control, self._results),
+                name=f"adaptor-worker-{i}", daemon=True
+            )
+            proc.start()
+            self._controls.append(control)
+            self._procs.append(proc)
+
+    def _call(self, cmd):
+        with self._lock:
+            request_id = next(self._request_ids)
+            for control in self._controls:
+                control.put((request_id, cmd))
+            replies = {}
+            deadline = time.monotonic() + WORKER_CALL_TIMEOUT
+            while len(replies) < self.num_workers:
+                try:
+                    reply_id, worker_id, reply = self._results.get(timeout=max(deadline - time.monotonic(), 0))
+                except Empty:
+                    print(f"⚠️ Only {len(replies)}/{self.num_workers} workers answered '{cmd}'", flush=True)
+                    break
+                if reply_id != request_id:
+                    # Late answer to an earlier call that timed out
+                    continue
+                replies[worker_id] = reply
+            return replies
+
+    def refresh_subscriptions(self):
+        merged = {"new_topics": set(), "removed_topics": set(), "updated_topics": set()}
+        for reply in self._call("refresh").values():
+            if "error" in reply:
+                continue
+            for key, topics in merged.items():
+                topics.update(reply.get(key, []))
+        return {key: sorted(topics) for key, topics in merged.items()}
+
+    def metrics(self):
+        return {"workers": self._call("metrics")}
+
+    def collect_metrics(self):
+        """Every worker's samples, labelled with its worker id."""
+        families, samples = {}, []
+        for worker_id, reply in sorted(self._call("collect").items()):
+            if isinstance(reply, dict):
+                continue
+            worker_families, worker_samples = reply
+            families.update(worker_families)
+            worker = (("worker", str(worker_id)),)
+            samples.extend((family, name, worker + labels, value)
+                           for family, name, labels, value in worker_samples)
+        return families, samples
+
+    def stop(self):
+        for control in self._controls:
+            control.put("stop")
+        for proc in self._procs:
+            proc.join(timeout=15)
+
+
 class RefreshAPI:
     exposed = True
 
+    def __init__(self, adaptor):
+        self.adaptor = adaptor
+
     @cherrypy.tools.json_out()
     def PUT(self):
-        added = adaptor.refresh_subscriptions()
-        return {"new_topics": added}
+        return self.adaptor.refresh_subscriptions()
+
+class MetricsAPI:
+    exposed = True
+
+    def __init__(self, adaptor):
+        self.adaptor = adaptor
+
+    def GET(self, format="prometheus"):
+        if format == "json":
+            cherrypy.response.headers["Content-Type"] = "application/json"
+            return json.dumps(self.adaptor.metrics()).encode()
+        cherrypy.response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return render_metrics(*self.adaptor.collect_metrics()).encode()
 
 if __name__ == '__main__':
-    adaptor = InfluxDBAdaptor()
-    threading.Thread(
-        target=lambda: (
-            adaptor.mqtt_client.connect(adaptor.mqtt_host, adaptor.mqtt_port, keepalive=60),
-            adaptor.mqtt_client.loop_forever()
-        ), daemon=True
-    ).start()
+    if NUM_WORKERS > 1:
+        adaptor = WorkerPool(NUM_WORKERS)
+    else:
+        adaptor = InfluxDBAdaptor()
+    adaptor.start()
     cherrypy.config.update({'server.socket_host': '0.0.0.0', 'server.socket_port': 8081})
     cherrypy.tree.mount(
-        RefreshAPI(), '/refresh',
+        RefreshAPI(adaptor), '/refresh',
+        {'/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}}
+    )
+    cherrypy.tree.mount(
+        MetricsAPI(adaptor), '/metrics',
         {'/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}}
     )
-    print("🚀 Refresh API running on http://0.0.0.0:8081/refresh", flush=True)
+    cherrypy.engine.subscribe('stop', adaptor.stop)
+    # Turn SIGTERM (docker stop) into an engine stop so the 'stop' subscribers run
+    cherrypy.engine.signals.subscribe()
+    print("🚀 Refresh API running on http://0.0.0.0:8081/refresh, metrics on /metrics", flush=True)
     cherrypy.engine.start()
     cherrypy.engine.block()
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+One-off migration of the sensor database to the catalog's "retentionTiers".
+
+    python RetentionMigrate.py
+
+Creates any missing policy and continuous query, backfills every downsampled
+tier from the raw points still on disk (continuous queries only cover new
+data), then sets each retention policy to its configured duration. Shrinking
+the raw policy deletes raw points older than its new duration, which is why
+the adaptor never does it on its own. Run it once, from the adaptor container,
+when the tiers are introduced or changed.
+"""
+import os
+import argparse
+from urllib.parse import urlparse
+
+import requests
+from influxdb import InfluxDBClient
+
+import InfluxdbAdaptor as adaptor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill downsampled tiers, then apply the retention tiers")
+    parser.add_argument("--backend", default=os.getenv("BACKEND_URL", "http://backend:8080"),
+                        help="backend URL to read the catalog's influxdb section from")
+    args = parser.parse_args()
+
+    resp = requests.get(f"{args.backend.rstrip('/')}/getCatalog", params={"fields": "influxdb"}, timeout=5)
+    resp.raise_for_status()
+    influx_cfg = resp.json().get("influxdb", {})
+    db = influx_cfg.get("sensorDataBaseName", "plants_measurements")
+    tiers = influx_cfg.get("retentionTiers", adaptor.DEFAULT_RETENTION_TIERS)
+    url = urlparse(influx_cfg.get("url", "http://localhost:8086"))
+
+    client = InfluxDBClient(host=url.hostname or "localhost", port=url.port or 8086)
+    print(f"📊 Migrating '{db}' to {[(t['name'], t['duration']) for t in tiers]}", flush=True)
+    adaptor.apply_retention(client, db, tiers)
+    print("✅ Retention tiers applied", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Sensor payload formats and plausibility checks, shared by the InfluxDB
+adaptor and the stream mode of RealtimeAnalysis so that both accept exactly
+the same readings. A plant or sensor picks its format with "payloadFormat"
+in the catalog.
+
+The adaptor image is built from this directory; the RealtimeAnalysis image
+copies this file in (see RealtimeAnalysis/Dockerfile).
+"""
+import json
+import math
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Plausible (min, max) per measurement; readings outside are rejected
+MEASURE_RANGES = {
+    "temperature": (-40.0, 85.0),
+    "humidity":    (0.0, 100.0),
+    "moisture":    (0.0, 100.0),
+    "ph":          (0.0, 14.0),
+    "watertank":   (0.0, 100.0),
+}
+
+
+class PayloadError(ValueError):
+    """A sensor payload that must not be stored; `reason` is the metrics counter it falls under."""
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise PayloadError("missing_value", f"value is not a number: {value!r}")
+    return value
+
+
+class JsonCodec:
+    """{"value": <number>, "timestamp": <optional>} as sent by the device connector."""
+    def decode(self, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError as e:
+            raise PayloadError("decode", f"invalid JSON: {e}")
+        if not isinstance(data, dict) or "value" not in data:
+            raise PayloadError("missing_value", "no value in payload")
+        return _number(data["value"]), data.get("timestamp")
+
+
+class TextCodec:
+    """Raw float text, optionally followed by a timestamp: b"23.5" or b"23.5 1700000000.123"."""
+    def decode(self, payload):
+        parts = payload.split()
+        if not 1 <= len(parts) <= 2:
+            raise PayloadError("decode", f"expected '<value> [timestamp]', got {payload[:32]!r}")
+        try:
+            value = float(parts[0])
+            device_ts = float(parts[1]) if len(parts) == 2 else None
+        except ValueError as e:
+            raise PayloadError("decode", f"invalid number: {e}")
+        return value, device_ts
+
+
+class StructCodec:
+    """
+    Fixed-width little-endian binary: float64 value followed by an int64 epoch
+    millisecond timestamp (0 when the device has no clock).
+    """
+    _STRUCT = struct.Struct("<dq")
+
+    def decode(self, payload):
+        if len(payload) != self._STRUCT.size:
+            raise PayloadError("decode", f"expected {self._STRUCT.size} bytes, got {len(payload)}")
+        value, ts_ms = self._STRUCT.unpack(payload)
+        return value, ts_ms or None
+
+
+class MsgpackCodec:
+    """MessagePack, either a bare number or a map shaped like the JSON payload."""
+    def decode(self, payload):
+        try:
+            data = msgpack.unpackb(payload)
+        except Exception as e:
+            raise PayloadError("decode", f"invalid msgpack: {e}")
+        if isinstance(data, dict):
+            if "value" not in data:
+                raise PayloadError("missing_value", "no value in payload")
+            return _number(data["value"]), data.get("timestamp")
+        return _number(data), None
+
+
+CODECS = {
+    "json":   JsonCodec(),
+    "text":   TextCodec(),
+    "struct": StructCodec(),
+}
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+
+def register_codec(name, codec):
+    """Make a codec (any object with decode(bytes) -> (value, device_ts)) selectable from the catalog."""
+    CODECS[name] = codec
+
+
+def validate_reading(measurement, value):
+    value = float(value)
+    if not math.isfinite(value):
+        raise PayloadError("out_of_range", f"{measurement} is not finite: {value}")
+    bounds = MEASURE_RANGES.get(measurement)
+    if bounds and not bounds[0] <= value <= bounds[1]:
+        raise PayloadError("out_of_range", f"{measurement}={value} outside {bounds}")
+    return value
+
+
+def decode_reading(payload, fmt, measurement):
+    """(value, device timestamp or None) of a sensor message; PayloadError if it must not be used."""
+    codec = CODECS.get(fmt)
+    if codec is None:
+        raise PayloadError("unsupported_format", f"no codec for format '{fmt}'")
+    value, device_ts = codec.decode(payload)
+    return validate_reading(measurement, value), device_ts
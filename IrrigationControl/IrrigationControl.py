@@ -1,6 +1,7 @@
 import os
 import json
 import logging
+import threading
 import requests
 import paho.mqtt.client as mqtt
 from influxdb import InfluxDBClient
@@ -11,6 +12,8 @@ from cherrypy import tools, dispatch, engine, config, tree
 from datetime import datetime, timedelta, timezone, date
 
 CATALOG_URL       = os.getenv("CATALOG_URL", "http://0.0.0.0:8080/getCatalog").rstrip('/')
+PLANTS_URL        = CATALOG_URL.rsplit('/', 1)[0] + "/getPlants"
+CATALOG_EVENTS_TOPIC = os.getenv("CATALOG_EVENTS_TOPIC", "catalog/events")
 IRR_EVAL_INTERVAL = int(os.getenv("IRR_EVAL_INTERVAL_SEC", "60"))
 SIM_INTERVAL_SEC  = float(os.getenv("SIM_INTERVAL_SEC", "1"))    # segundos reales por minuto simulado
 SCHEDULED_TIMES   = os.getenv("IRR_SCHEDULED_TIMES", "06:00,14:00,18:00").split(',')
@@ -40,42 +43,123 @@ class IrrigationController:
         self.mqtt = mqtt.Client(client_id="IrrigationController")
         self.sim_interval = SIM_INTERVAL_SEC
         self.scheduler = None
+        self.session = requests.Session()
+        self.catalog_etag = None
+        self.catalog_version = None
+        self.catalog_stale = True     # plant table may have missed catalog events
+        self._catalog_lock = threading.Lock()
+        self.broker_ip = self.broker_port = None
+        self.influx_cfg = {}
 
+        self._load_config()
         self._load_catalog()
         self._setup_influx()
         self._setup_mqtt()
         self._setup_scheduler()
 
-    def _load_catalog(self):
+    def _load_config(self):
         try:
-            response = requests.get(CATALOG_URL, timeout=5)
+            response = self.session.get(CATALOG_URL, params={"fields": "broker,influxdb"}, timeout=5)
             response.raise_for_status()
-            catalog = response.json()
-            broker = catalog.get("broker", {})
+            config = response.json()
+            broker = config.get("broker", {})
             self.broker_ip = broker.get("IP")
             self.broker_port = broker.get("port")
-            self.plants.clear()
-            for user in catalog.get("userList", []):
-                owner = user.get("userName")
-                for plant in user.get("plantsList", []):
-                    serial = plant.get("deviceConnectorSerialNumber")
-                    mode   = plant.get("irrigationMode", "only notifications").lower()
-                    topic  = plant.get("waterPump", {}).get("mqttTopic")
-                    ptype  = plant.get("plantType", "").lower()
-                    if serial and topic:
-                        self.plants[serial] = {
-                            "owner": owner,
-                            "mode": mode,
-                            "topic": topic,
-                            "type": ptype
-                        }
-            logger.info(f"✅ Catalog loaded: {len(self.plants)} plants")
+            self.influx_cfg = config.get("influxdb", {})
         except Exception as e:
-            logger.error(f"❌ Failed to load catalog: {e}")
+            logger.error(f"❌ Failed to load configuration: {e}")
+
+    @staticmethod
+    def _plant_entry(owner, plant):
+        topic = (plant.get("waterPump") or {}).get("mqttTopic")
+        if not topic:
+            return None
+        return {
+            "owner": owner,
+            "mode": plant.get("irrigationMode", "only notifications").lower(),
+            "topic": topic,
+            "type": plant.get("plantType", "").lower()
+        }
+
+    def _load_catalog(self):
+        """
+        Reload the plant table from /getPlants unless catalog events are
+        keeping it current. A 304 on the first page means nothing changed.
+        """
+        if not self.catalog_stale and self.mqtt.is_connected():
+            return
+        with self._catalog_lock:
+            try:
+                params = {"fields": "irrigationMode,waterPump,plantType"}
+                headers = {"If-None-Match": self.catalog_etag} if self.catalog_etag else {}
+                plants, etag, version = {}, None, None
+                while True:
+                    response = self.session.get(PLANTS_URL, params=params, headers=headers, timeout=5)
+                    if response.status_code == 304:
+                        self.catalog_stale = False
+                        return
+                    response.raise_for_status()
+                    page = response.json()
+                    etag = etag or response.headers.get("ETag")
+                    if version is None:
+                        version = page.get("catalogVersion", 0)
+                    for plant in page.get("plants", []):
+                        serial = plant.get("deviceConnectorSerialNumber")
+                        entry = self._plant_entry(plant.get("owner"), plant)
+                        if serial and entry:
+                            plants[serial] = entry
+                    if not page.get("nextCursor"):
+                        break
+                    params["cursor"] = page["nextCursor"]
+                    headers = {}
+                self.plants = plants
+                self.catalog_etag = etag
+                self.catalog_version = version
+                self.catalog_stale = False
+                logger.info(f"✅ Catalog loaded: {len(self.plants)} plants (version {version})")
+            except Exception as e:
+                logger.error(f"❌ Failed to load catalog: {e}")
+
+    def _on_catalog_event(self, client, userdata, msg):
+        """
+        Apply a pushed catalog commit to the plant table. The next job reloads
+        from /getPlants if a version was skipped.
+        """
+        try:
+            message = json.loads(msg.payload)
+        except ValueError:
+            return
+        with self._catalog_lock:
+            version = message.get("version", 0)
+            if self.catalog_version is None or version <= self.catalog_version:
+                return
+            if version != self.catalog_version + 1:
+                self.catalog_stale = True
+                return
+            plants = dict(self.plants)   # copy-on-write: cycles may be iterating the old table
+            for event in message.get("events", []):
+                serial = event.get("plantSerial")
+                if serial is None:
+                    continue
+                entry = self._plant_entry(event["userName"], event["plant"]) if event.get("plant") else None
+                if entry:
+                    plants[serial] = entry
+                else:
+                    plants.pop(serial, None)
+                logger.info(f"📥 Catalog event {event['event']} for {serial}")
+            self.plants = plants
+            self.catalog_version = version
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(CATALOG_EVENTS_TOPIC, qos=1)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.catalog_stale = True
 
     def _setup_influx(self):
         try:
-            influx_cfg = requests.get(CATALOG_URL, timeout=5).json().get("influxdb", {})
+            influx_cfg = self.influx_cfg
             url = influx_cfg.get("url", "http://0.0.0.0:8086")
             sensor_db   = influx_cfg.get("sensorDataBaseName", "plants_measurements")
             analysis_db = influx_cfg.get("microServicesDataBaseName", "analysis_data")
@@ -88,6 +172,9 @@ class IrrigationController:
             logger.error(f"❌ Failed to setup InfluxDB: {e}")
 
     def _setup_mqtt(self):
+        self.mqtt.on_connect = self._on_connect
+        self.mqtt.on_disconnect = self._on_disconnect
+        self.mqtt.message_callback_add(CATALOG_EVENTS_TOPIC, self._on_catalog_event)
         try:
             self.mqtt.connect(self.broker_ip, self.broker_port)
             self.mqtt.loop_start()
@@ -182,7 +269,9 @@ class IrrigationController:
                     'alert': alert,
                     'timestamp': timestamp,
                     'username': info['owner'],
-                    'plant': serial
+                    'plant': serial,
+                    # A notice, not a condition: the backend never coalesces this kind
+                    'kind': 'irrigation'
                 },
                 timeout=5
             )
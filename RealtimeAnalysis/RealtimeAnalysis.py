@@ -1,6 +1,8 @@
 import os
+import sys
 import time
 import logging
+import threading
 import requests
 from urllib.parse import urlparse
 from datetime import datetime, timezone
@@ -8,14 +10,27 @@ from datetime import datetime, timezone
 import numpy as np
 from influxdb import InfluxDBClient
 from sklearn.linear_model import LinearRegression
+import paho.mqtt.client as mqtt
+
+# The image copies SensorCodecs.py next to this file; in a checkout it lives with the adaptor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "InfluxdbAdaptor"))
+from SensorCodecs import CODECS, PayloadError, decode_reading
 
 BACKEND_URL      = os.getenv("BACKEND_URL", "http://127.0.0.1:8080").rstrip('/')
 CATALOG_ENDPOINT = f"{BACKEND_URL}/getCatalog"
 RT_INTERVAL_SEC  = int(os.getenv("RT_INTERVAL_SEC", "5")) 
+RT_LOOKBACK      = os.getenv("RT_LOOKBACK", "1h")                  # only readings newer than this are analyzed
+RT_WRITE_BATCH   = int(os.getenv("RT_WRITE_BATCH", "5000"))        # points per InfluxDB write request
+RT_MODE          = os.getenv("RT_MODE", "poll")                    # 'poll' reads InfluxDB each cycle, 'stream' consumes MQTT
+RT_EMIT_INTERVAL_SEC = float(os.getenv("RT_EMIT_INTERVAL_SEC", "1"))  # stream mode: how often filtered points are written
+RT_EMIT_MIN_CHANGE   = float(os.getenv("RT_EMIT_MIN_CHANGE", "0"))    # stream mode: skip plants whose filtered values moved less
 KALMAN_PVAR      = float(os.getenv("KALMAN_PROCESS_VAR", "1e-5"))
 KALMAN_MVAR      = float(os.getenv("KALMAN_MEASURE_VAR", "0.1"))
 KALMAN_ERR       = float(os.getenv("KALMAN_INIT_ERROR",  "1.0"))
 
+METRICS = ["temperature", "humidity", "moisture", "ph"]
+METRIC_INDEX = {m: j for j, m in enumerate(METRICS)}
+
 OPTIMAL_RANGES = {
     "cactus":       {"moisture": (10, 30), "temperature": (25, 35), "humidity": (30, 50), "ph": (6.5, 7.5)},
     "spider plant": {"moisture": (40, 60), "temperature": (18, 28), "humidity": (40, 70), "ph": (6.0, 7.0)},
@@ -25,13 +40,26 @@ OPTIMAL_RANGES = {
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+_session = requests.Session()
+_catalog_cache = {"etag": None, "catalog": None}
+
 def load_catalog():
-    """Fetch the latest catalog, retrying until successful."""
+    """
+    Fetch the latest catalog, retrying until successful. The last ETag is sent
+    back, so while the catalog is unchanged the backend answers 304 and the
+    previously parsed catalog (the same object) is returned.
+    """
     while True:
         try:
-            resp = requests.get(CATALOG_ENDPOINT, timeout=5)
+            etag = _catalog_cache["etag"]
+            headers = {"If-None-Match": etag} if etag else {}
+            resp = _session.get(CATALOG_ENDPOINT, headers=headers, timeout=5)
+            if resp.status_code == 304 and _catalog_cache["catalog"] is not None:
+                return _catalog_cache["catalog"]
             resp.raise_for_status()
-            return resp.json()
+            _catalog_cache["catalog"] = resp.json()
+            _catalog_cache["etag"] = resp.headers.get("ETag")
+            return _catalog_cache["catalog"]
         except Exception as e:
             logging.warning(f"Waiting for catalog: {e}")
             time.sleep(2)
@@ -61,31 +89,140 @@ INFLUX_PORT = parsed.port     or 8086
 influx = InfluxDBClient(host=INFLUX_HOST, port=INFLUX_PORT)
 influx.switch_database(DB_SENSOR)
 
-class KalmanFilter:
-    """Simple 1D Kalman filter for smoothing."""
-    def __init__(self, q=KALMAN_PVAR, r=KALMAN_MVAR, p=KALMAN_ERR, x0=0.0):
-        self.q = q
-        self.r = r
-        self.p = p
-        self.x = x0
-
-    def update(self, z):
-        self.p += self.q
-        k = self.p / (self.p + self.r)
-        self.x += k * (z - self.x)
-        self.p *= (1 - k)
-        return self.x
+class KalmanBank:
+    """
+    Simple 1D Kalman filters for smoothing, one per plant and metric, kept as
+    NumPy arrays: row `slots[serial]` of x, p, q and r holds that plant's
+    filters for METRICS. Rows of removed plants go on a free list and are
+    reused by the next plant added; the arrays double when it runs out.
+    update() filters a whole block of rows in one vectorized step.
+    """
+    def __init__(self, q=KALMAN_PVAR, r=KALMAN_MVAR, p=KALMAN_ERR, capacity=64):
+        self.q0, self.r0, self.p0 = q, r, p
+        self.slots = {}     # serial -> row
+        self.x = np.zeros((0, len(METRICS)))
+        self.p = self.q = self.r = self.x
+        self._free = []
+        self._grow(capacity)
+
+    def _grow(self, rows):
+        size = len(self.x)
+        shape = (rows, len(METRICS))
+        self.x = np.concatenate([self.x, np.zeros(shape)])
+        self.p = np.concatenate([self.p, np.full(shape, self.p0)])
+        self.q = np.concatenate([self.q, np.full(shape, self.q0)])
+        self.r = np.concatenate([self.r, np.full(shape, self.r0)])
+        self._free.extend(range(size + rows - 1, size - 1, -1))
+
+    def __contains__(self, serial):
+        return serial in self.slots
+
+    def add(self, serial):
+        """Give a plant a row with fresh filters."""
+        if serial in self.slots:
+            return
+        if not self._free:
+            self._grow(max(len(self.x), 1))
+        row = self._free.pop()
+        self.x[row], self.p[row], self.q[row], self.r[row] = 0.0, self.p0, self.q0, self.r0
+        self.slots[serial] = row
+
+    def remove(self, serial):
+        row = self.slots.pop(serial, None)
+        if row is not None:
+            self._free.append(row)
+
+    def rows(self, serials):
+        """Slot table rows of the given plants, for update()."""
+        return np.fromiter((self.slots[s] for s in serials), dtype=np.intp, count=len(serials))
+
+    def update(self, rows, z):
+        """
+        Filter readings z of shape (len(rows), len(METRICS)) in one step and
+        return the filtered values; NaN readings leave their filter untouched.
+        """
+        x = self.x[rows]
+        p = self.p[rows] + self.q[rows]
+        k = p / (p + self.r[rows])
+        seen = ~np.isnan(z)
+        if seen.all():
+            x += k * (z - x)
+            p *= 1 - k
+        else:
+            x = np.where(seen, x + k * (np.where(seen, z, x) - x), x)
+            p = np.where(seen, p * (1 - k), self.p[rows])
+        self.x[rows] = x
+        self.p[rows] = p
+        return x
+
+    def update_one(self, serial, metric, z):
+        """Filter a single reading; the streaming path's per-message step."""
+        row, col = self.slots[serial], METRIC_INDEX[metric]
+        p = self.p[row, col] + self.q[row, col]
+        k = p / (p + self.r[row, col])
+        self.x[row, col] += k * (z - self.x[row, col])
+        self.p[row, col] = p * (1 - k)
+        return float(self.x[row, col])
+
+def fetch_latest(plants):
+    """
+    Last reading of every metric for all plants with one query grouped by the
+    owner and plant tags. Returns an array of shape (len(plants), len(METRICS)),
+    NaN where a plant has no recent reading of a metric.
+    """
+    values = np.full((len(plants), len(METRICS)), np.nan)
+    if not plants:
+        return values
+    rows = {(p["owner"], p["serial"]): i for i, p in enumerate(plants)}
+    columns = METRIC_INDEX
+    measurements = ",".join(f'"{m}"' for m in METRICS)
+    q = (
+        f'SELECT LAST("value") AS v FROM {measurements} '
+        f'WHERE time > now() - {RT_LOOKBACK} GROUP BY "owner", "plant"'
+    )
+    for (measurement, tags), points in influx.query(q, database=DB_SENSOR).items():
+        row = rows.get((tags.get("owner"), tags.get("plant")))
+        if row is None or measurement not in columns:
+            continue
+        for pt in points:
+            if pt.get("v") is not None:
+                values[row, columns[measurement]] = float(pt["v"])
+    return values
+
+def analysis_point(owner, serial, raw_vals, filt, now):
+    return {
+        "measurement": "realtime_analysis",
+        "tags":       {"owner": owner, "plant": serial},
+        "time":        now,
+        "fields":      {f"raw_{m}": raw_vals[m] for m in raw_vals}
+                    | {f"filt_{m}": filt[m] for m in filt}
+    }
 
 class RealTimeAnalyzer:
     def __init__(self):
-        self.kalman = {}  
+        self.kalman = KalmanBank()
+        self.rows = np.zeros(0, dtype=np.intp)    # kalman row of each entry of self.plants
         self.plants = []
         self.alert_counters = {} 
+        self._catalog = None
+        # Stream mode: topic -> (serial, metric, format) and per-plant state, guarded by _lock
+        self.topics = {}
+        self.owners = {}
+        self.latest = {}
+        self.filtered = {}
+        self.emitted = {}
+        self.dirty = set()
+        self._lock = threading.Lock()
+        self.mqtt = None
 
     def refresh_plants(self):
         """Reload plant list from catalog and manage Kalman filters and counters."""
         cat = load_catalog()
+        if cat is self._catalog:
+            return
+        self._catalog = cat
         new_plants = []
+        topics = {}
         for u in cat.get("userList", []):
             owner = u["userName"]
             for p in u.get("plantsList", []):
@@ -98,64 +235,141 @@ class RealTimeAnalyzer:
                     "type": ptype,
                     "name": plant_name
                 })
+                for sensor in p.get("sensorList") or []:
+                    metric = (sensor.get("measureType") or "").strip().lower()
+                    if sensor.get("mqttTopic") and metric in METRICS:
+                        fmt = sensor.get("payloadFormat", p.get("payloadFormat", "json"))
+                        if fmt not in CODECS:
+                            logging.warning(f"Unsupported payload format '{fmt}' for {sensor['mqttTopic']}, "
+                                            f"readings will be ignored")
+                        topics[sensor["mqttTopic"]] = (serial, metric, fmt)
 
         new_serials = {p["serial"] for p in new_plants}
-        old_serials = set(self.kalman.keys())
-        for s in new_serials - old_serials:
-            self.kalman[s] = {m: KalmanFilter() for m in ["temperature","humidity","moisture","ph"]}
+        with self._lock:
+            old_serials = set(self.kalman.slots)
+            for s in new_serials - old_serials:
+                self.kalman.add(s)
+
+            for s in old_serials - new_serials:
+                self.kalman.remove(s)
+                for state in (self.latest, self.filtered, self.emitted):
+                    state.pop(s, None)
+                self.dirty.discard(s)
 
-        for s in old_serials - new_serials:
-            self.kalman.pop(s, None)
+            for p in new_plants:
+                if p["serial"] not in self.alert_counters:
+                    self.alert_counters[p["serial"]] = 0
 
-        for p in new_plants:
-            if p["serial"] not in self.alert_counters:
-                self.alert_counters[p["serial"]] = 0
+            for s in set(self.alert_counters) - new_serials:
+                self.alert_counters.pop(s, None)
 
-        for s in set(self.alert_counters) - new_serials:
-            self.alert_counters.pop(s, None)
+            self.plants = new_plants
+            self.rows = self.kalman.rows([p["serial"] for p in new_plants])
+            self.owners = {p["serial"]: p["owner"] for p in new_plants}
+        self._set_topics(topics)
 
-        self.plants = new_plants
+    def _set_topics(self, topics):
+        """Swap in the sensor topic map and, when streaming, subscribe to the difference."""
+        old, self.topics = self.topics, topics
+        if not self.mqtt or not self.mqtt.is_connected():
+            return
+        added = [t for t in topics if t not in old]
+        removed = [t for t in old if t not in topics]
+        if added:
+            self.mqtt.subscribe([(t, 0) for t in added])
+        if removed:
+            self.mqtt.unsubscribe(removed)
 
     def run_cycle(self):
+        """Read the latest values of all plants at once, filter them and write one batch."""
         now = datetime.now(timezone.utc).isoformat()
+        values = fetch_latest(self.plants)
+        complete = ~np.isnan(values).any(axis=1)
 
-        for p in self.plants:
-            owner, serial, ptype, plant_name = p["owner"], p["serial"], p["type"], p["name"]
+        ready = [self.plants[i] for i in np.flatnonzero(complete)]
+        raw = values[complete]
+        filtered = self.kalman.update(self.rows[complete], raw)
 
-            influx.switch_database(DB_SENSOR)
+        points = [
+            analysis_point(p["owner"], p["serial"], dict(zip(METRICS, r)), dict(zip(METRICS, f)), now)
+            for p, r, f in zip(ready, raw.tolist(), filtered.tolist())
+        ]
 
-            raw_vals = {}
-            for m in ["temperature","humidity","moisture","ph"]:
-                q = (
-                    f'SELECT LAST("value") AS v '
-                    f'FROM "{m}" '
-                    f'WHERE "owner"=\'{owner}\' AND "plant"=\'{serial}\''
-                )
-                pts = list(influx.query(q).get_points())
-                if pts and pts[0].get("v") is not None:
-                    raw_vals[m] = float(pts[0]["v"])
-            if len(raw_vals) < 4:
-                continue
+        if points:
+            influx.write_points(points, database=DB_ANALYSIS, batch_size=RT_WRITE_BATCH)
+        logging.info(f"RT written for {len(points)}/{len(self.plants)} plants")
 
-            filt = {m: self.kalman[serial][m].update(raw_vals[m])
-                    for m in raw_vals}
 
-            influx.switch_database(DB_ANALYSIS)
+    def start_streaming(self):
+        """Subscribe to the plants' sensor topics and filter every reading as it arrives."""
+        broker = load_catalog().get("broker", {})
+        self.mqtt = mqtt.Client(client_id="RealtimeAnalysis")
+        self.mqtt.on_connect = self._on_connect
+        self.mqtt.on_message = self._on_message
+        self.mqtt.connect(broker.get("IP", "localhost"), broker.get("port", 1883))
+        self.mqtt.loop_start()
+        logging.info(f"Streaming sensor topics from {broker.get('IP', 'localhost')}:{broker.get('port', 1883)}")
 
-            point = {
-                "measurement": "realtime_analysis",
-                "tags":       {"owner": owner, "plant": serial},
-                "time":        now,
-                "fields":      {f"raw_{m}": raw_vals[m] for m in raw_vals}
-                            | {f"filt_{m}": filt[m] for m in filt}
-            }
-            influx.write_points([point])
-            logging.info(f"RT written for {serial}")
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0 and self.topics:
+            client.subscribe([(t, 0) for t in self.topics])
 
+    def _on_message(self, client, userdata, msg):
+        info = self.topics.get(msg.topic)
+        if not info:
+            return
+        serial, metric, fmt = info
+        try:
+            # Same codecs and range checks as the adaptor, so the filter only sees what gets stored
+            value, _ = decode_reading(msg.payload, fmt, metric)
+        except PayloadError as e:
+            logging.debug(f"Ignoring reading on {msg.topic}: {e}")
+            return
+        with self._lock:
+            if serial not in self.kalman:
+                return
+            self.latest.setdefault(serial, {})[metric] = value
+            self.filtered.setdefault(serial, {})[metric] = self.kalman.update_one(serial, metric, value)
+            self.dirty.add(serial)
+
+    def emit(self):
+        """
+        Stream mode: write the filtered state of every plant updated since the
+        last call, in one batch. Plants need a reading of every metric first;
+        with RT_EMIT_MIN_CHANGE set, plants whose filtered values all moved
+        less than that since their last point are skipped.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        points = []
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+            for serial in dirty:
+                raw_vals, filt = self.latest.get(serial, {}), self.filtered.get(serial, {})
+                if len(raw_vals) < len(METRICS):
+                    continue
+                last = self.emitted.get(serial)
+                if last and RT_EMIT_MIN_CHANGE > 0 and all(
+                        abs(filt[m] - last[m]) < RT_EMIT_MIN_CHANGE for m in METRICS):
+                    continue
+                self.emitted[serial] = dict(filt)
+                points.append(analysis_point(self.owners[serial], serial, dict(raw_vals), dict(filt), now))
+        if points:
+            influx.write_points(points, database=DB_ANALYSIS, batch_size=RT_WRITE_BATCH)
+            logging.info(f"RT written for {len(points)} plants")
 
     def start(self):
-        """Main loop: refresh plants and perform analysis cycles."""
-        logging.info("Starting Real-Time Analysis (dynamic)...")
+        """Main loop: refresh plants and perform analysis cycles, or stream and emit."""
+        logging.info(f"Starting Real-Time Analysis (dynamic, {RT_MODE} mode)...")
+        if RT_MODE == "stream":
+            self.refresh_plants()
+            self.start_streaming()
+            next_refresh = time.monotonic() + RT_INTERVAL_SEC
+            while True:
+                time.sleep(RT_EMIT_INTERVAL_SEC)
+                if time.monotonic() >= next_refresh:
+                    self.refresh_plants()
+                    next_refresh = time.monotonic() + RT_INTERVAL_SEC
+                self.emit()
         while True:
             self.refresh_plants()
             self.run_cycle()
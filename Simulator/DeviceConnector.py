@@ -72,7 +72,7 @@ class DeviceConnectorSimulator:
         self.pump.link_water_tank(self.tank)
 
         self.tank.set_publish_callback(lambda pct:
-            self.client.publish(self.topics["tank_status"], json.dumps({"value": pct}))
+            self.client.publish(self.topics["tank_status"], json.dumps({"value": pct, "timestamp": round(time.time(), 3)}))
         )
         self.tank._publish_percentage()
 
@@ -107,8 +107,9 @@ class DeviceConnectorSimulator:
                         self.topics["soil_moisture"]: self.soil_sensor.simulate(),
                         self.topics["ph"]:            self.ph_sensor.simulate()
                     }
+                    ts = round(time.time(), 3)
                     for topic, val in readings.items():
-                        self.client.publish(topic, json.dumps({"value": val}))
+                        self.client.publish(topic, json.dumps({"value": val, "timestamp": ts}))
                     self.pump.tick()
                     time.sleep(self.interval)
             finally:
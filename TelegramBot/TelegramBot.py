@@ -61,6 +61,8 @@ class ProjectBot(object):
         try:
             async with websockets.connect(WS_URL) as websocket:
                 print(f"🔔 Connected to WebSocket at {WS_URL}")
+                # The backend only routes alerts to subscribed clients; the bot relays every user's
+                await websocket.send(json.dumps({"type": "subscribe", "all": True}))
                 async for message in websocket:
                     try:
                         alert = json.loads(message)
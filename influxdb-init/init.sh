@@ -2,4 +2,17 @@ set -e
 
 influx -execute "CREATE DATABASE plants_measurements"
 influx -execute "CREATE DATABASE analysis_data"
-influx -execute "CREATE DATABASE user_notifications"
\ No newline at end of file
+influx -execute "CREATE DATABASE user_notifications"
+
+# Retention tiers for sensor data (keep in sync with "retentionTiers" in the catalog):
+# raw points for 48h, 1-minute aggregates for 30 days, hourly aggregates for 5 years.
+# The image only runs this script on an empty data directory; existing deployments
+# migrate once with InfluxdbAdaptor/RetentionMigrate.py instead.
+influx -execute "CREATE RETENTION POLICY one_minute ON plants_measurements DURATION 30d REPLICATION 1"
+influx -execute "CREATE RETENTION POLICY one_hour ON plants_measurements DURATION 260w REPLICATION 1"
+influx -execute 'CREATE CONTINUOUS QUERY cq_one_minute ON plants_measurements RESAMPLE FOR 10m BEGIN SELECT mean("value") AS "value", min("value") AS "min", max("value") AS "max" INTO "plants_measurements"."one_minute".:MEASUREMENT FROM "plants_measurements"."autogen"./.*/ GROUP BY time(1m), * END'
+influx -execute 'CREATE CONTINUOUS QUERY cq_one_hour ON plants_measurements RESAMPLE FOR 2h BEGIN SELECT mean("value") AS "value", min("min") AS "min", max("max") AS "max" INTO "plants_measurements"."one_hour".:MEASUREMENT FROM "plants_measurements"."one_minute"./.*/ GROUP BY time(1h), * END'
+# Backfill the aggregates from any raw points before the raw policy shrinks and deletes them
+influx -database plants_measurements -execute 'SELECT mean("value") AS "value", min("value") AS "min", max("value") AS "max" INTO "plants_measurements"."one_minute".:MEASUREMENT FROM "plants_measurements"."autogen"./.*/ WHERE time > now() - 30d GROUP BY time(1m), * fill(none)'
+influx -database plants_measurements -execute 'SELECT mean("value") AS "value", min("value") AS "min", max("value") AS "max" INTO "plants_measurements"."one_hour".:MEASUREMENT FROM "plants_measurements"."autogen"./.*/ WHERE time > now() - 260w GROUP BY time(1h), * fill(none)'
+influx -execute "ALTER RETENTION POLICY autogen ON plants_measurements DURATION 48h SHARD DURATION 1h DEFAULT"